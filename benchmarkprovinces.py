@@ -0,0 +1,272 @@
+# Provincial: Province handling tool for Hearts of Iron IV
+# Thomas Slade, 2020
+
+# Benchmarks the core of each Provincial script on synthetic maps of several sizes (see generatesyntheticmap.py), recording how long each stage takes and its peak memory use.
+# Each stage also records a summary of its result, so that an optimisation which changes the output can be told apart from one that only changes the speed.
+# Results are written to the benchmark output directory, and compared against a saved baseline.
+
+import os
+import sys
+import json
+import time
+import hashlib
+import contextlib
+import numpy as numpy
+from provincialutils import *
+from provincialcli import parse_arguments
+from provincialprofiler import timed_span, start_recording
+from provincialsettings import *
+from generatesyntheticmap import generate_synthetic_map
+import fillprovinces
+import assignprovinces
+import generatedefinitions
+import validatemap
+
+# Get a hash of the way an image is split into areas of color, which doesn't depend on what the colors actually are.
+def get_partition_hash(image):
+    labels = LabelImage(image).labels.ravel()
+    # Renumber the labels in the order that they're first met, so that two images with the same areas in different colors produce the same labels.
+    first_indices = numpy.unique(labels, return_index = True)[1]
+    renumbering = numpy.empty(len(first_indices), dtype = numpy.int64)
+    renumbering[numpy.argsort(first_indices)] = numpy.arange(len(first_indices))
+    return hashlib.sha1(renumbering[labels].tobytes()).hexdigest()
+
+# Run the argued function as a span of the argued name, silencing its log. Returns its result, the seconds it took, and the peak memory it allocated (in bytes).
+def measure(span_name, function, *args):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), timed_span(span_name) as span:
+        result = function(*args)
+    return result, span.seconds, span.peak_bytes
+
+# The number of processes that the fill consistency check fills states across.
+consistency_process_count = 2
+
+# Fill every state of the argued province guide image across the argued number of processes, starting from an empty map. Returns the filled output and the number of states that failed.
+def fill_provinces(outline_image, process_count):
+    fillprovinces.fill_process_count = process_count
+    fillprovinces.used_cols = set()
+    fillprovinces.color_pools = {}
+    fillprovinces.undetermined_fragments = numpy.empty((0, 2), dtype = int)
+    fillprovinces.stray_border_fragments = numpy.empty((0, 2), dtype = int)
+
+    province_guide = LabelImage(outline_image)
+    state_areas = get_state_areas(province_guide)
+    province_output = numpy.zeros(province_guide.shape + (3,), dtype = numpy.uint8)
+    failed_state_count = fillprovinces.fill_states(state_areas, list(state_areas), province_output)
+    return province_output, failed_state_count
+
+# Fill every state of the synthetic map's province guide. States are always filled one at a time, since the memory used by fill processes isn't traced.
+def fill_stage(outline_image):
+    province_output, failed_state_count = fill_provinces(outline_image, 1)
+
+    return {"partition" : get_partition_hash(province_output), "failed_states" : failed_state_count,
+            "undetermined_fragments" : len(fillprovinces.undetermined_fragments), "stray_border_fragments" : len(fillprovinces.stray_border_fragments)}
+
+# Check that filling the synthetic map's province guide one state at a time and across several processes gives exactly the same colors.
+# Random palette colors are used, since they draw the most from each state's random sequence. The stage's peak memory leaves out the memory of the fill processes.
+def fill_consistency_stage(outline_image):
+    palette_setting = fillprovinces.random_state_palette_colors
+    fillprovinces.random_state_palette_colors = True
+    try:
+        serial_output = fill_provinces(outline_image, 1)[0]
+        parallel_output = fill_provinces(outline_image, consistency_process_count)[0]
+    finally:
+        fillprovinces.random_state_palette_colors = palette_setting
+
+    return {"matches_serial" : bool(numpy.array_equal(serial_output, parallel_output))}
+
+# Resolve undetermined fragments one at a time, the way fill_state resolved them before fragments were resolved from labels: each fragment is found by its color across the state view,
+# and its ring is counted pixel by pixel in row-major order. This is kept as a reference for resolve_fragments to agree with.
+# Unlike the original, a fragment never takes in pixels outside its state, which may hold the same color depending on the order that states are filled in.
+def resolve_fragments_per_pixel(state_view, state_mask, fragment_origins):
+    undetermined_origins = []
+    for u in fragment_origins:
+        fragment_mask = numpy.all(state_view == state_view[u[0], u[1]], axis = -1) & state_mask
+
+        mode_col = None
+        if fillprovinces.undetermined_pixel_handling != 0:
+            ring_mask = fillprovinces.get_cardinal_dilation(fragment_mask) & ~fragment_mask & state_mask
+            neighboring_cols = {}
+            highest_count = 0
+            for ring_col in state_view[ring_mask]:
+                tuple_col = tuple(int(c) for c in ring_col)
+                # If checking for ubiquity, and found a different color, there's no mode.
+                if fillprovinces.undetermined_pixel_handling == 1 and mode_col is not None and tuple_col != mode_col:
+                    mode_col = None
+                    break
+
+                neighboring_cols[tuple_col] = neighboring_cols.get(tuple_col, 0) + 1
+                if neighboring_cols[tuple_col] > highest_count:
+                    highest_count += 1
+                    mode_col = tuple_col
+
+        if mode_col is not None:
+            state_view[fragment_mask] = mode_col
+        else:
+            state_view[fragment_mask] = undetermined_col
+            undetermined_origins.append(u)
+
+    return undetermined_origins
+
+# Fill every state of the synthetic map's province guide with province fragments drawn onto it, under each undetermined_pixel_handling.
+# Each fill is checked against the same fill with the fragments resolved one pixel at a time, by resolve_fragments_per_pixel.
+def fragments_stage(fragmented_outline_image):
+    handling_setting, resolve_fragments = fillprovinces.undetermined_pixel_handling, fillprovinces.resolve_fragments
+    result = {}
+    try:
+        for handling in (0, 1, 2):
+            fillprovinces.undetermined_pixel_handling = handling
+            fillprovinces.resolve_fragments = resolve_fragments
+            province_output = fill_provinces(fragmented_outline_image, 1)[0]
+            undetermined_fragments = fillprovinces.undetermined_fragments
+
+            fillprovinces.resolve_fragments = resolve_fragments_per_pixel
+            reference_output = fill_provinces(fragmented_outline_image, 1)[0]
+
+            result["handling_{}".format(handling)] = {"matches_per_pixel" : bool(numpy.array_equal(province_output, reference_output) and
+                                                                                  numpy.array_equal(undetermined_fragments, fillprovinces.undetermined_fragments)),
+                                                      "undetermined_fragments" : len(undetermined_fragments)}
+    finally:
+        fillprovinces.undetermined_pixel_handling, fillprovinces.resolve_fragments = handling_setting, resolve_fragments
+
+    return result
+
+# Assign the synthetic map's provinces to its states.
+def assign_stage(province_image, outline_image, definitions_text):
+    assignprovinces.orphan_provs = []
+    assignprovinces.split_provs = []
+
+    definitions = DefinitionsTable(definitions_text)
+    state_provs, state_map = assignprovinces.find_states(LabelImage(outline_image))
+    assignprovinces.state_provs = state_provs
+    assignprovinces.get_constituent_provinces(state_map, LabelImage(province_image), definitions)
+
+    assignment = sorted((list(state), sorted(assignprovinces.state_provs[state])) for state in assignprovinces.state_provs)
+    return {"assignment" : hashlib.sha1(json.dumps(assignment).encode()).hexdigest(),
+            "orphan_provinces" : len(assignprovinces.orphan_provs), "split_provinces" : len(assignprovinces.split_provs)}
+
+# Generate the definitions of the synthetic map's provinces.
+def definitions_stage(province_image, terrain_image, definitions_text):
+    definitions = DefinitionsTable(definitions_text)
+    province_labels = LabelImage(province_image)
+    province_index = ProvinceIndex(province_labels)
+    prov_terrains, prov_types, prov_continents, prov_coastal, prov_lake_coastal = generatedefinitions.find_province_definitions(province_index, LabelImage(terrain_image))
+    generatedefinitions.set_province_definitions(definitions, province_labels.colors, prov_terrains, prov_types, prov_continents, prov_coastal)
+
+    return {"definitions" : hashlib.sha1(definitions.get_text().encode()).hexdigest(), "coastal_provinces" : int(numpy.count_nonzero(prov_coastal))}
+
+# Validate the synthetic map's provinces.
+def validate_stage(province_image):
+    validatemap.x_crossings = []
+    validatemap.spread_out_provinces = {}
+    validatemap.small_provinces = []
+    validatemap.undetermined_origins = []
+
+    province_labels = LabelImage(province_image)
+    validatemap.find_x_crossings(province_labels, None)
+    validatemap.check_prov_sizes(province_labels, None)
+
+    return {"x_crossings" : len(validatemap.x_crossings), "spread_out_provinces" : len(validatemap.spread_out_provinces),
+            "small_provinces" : len(validatemap.small_provinces)}
+
+# Benchmark every stage on a synthetic map of the argued size. Returns the measurements of each stage, keyed by stage name.
+def benchmark_size(width, height):
+    synthetic_map = generate_synthetic_map(width, height, synthetic_pixels_per_province, synthetic_provinces_per_state, synthetic_sea_fraction, synthetic_map_seed)
+    province_image = synthetic_map.get_province_image()
+    outline_image = synthetic_map.get_outline_image()
+    definitions_text = synthetic_map.get_definitions_text()
+    fragmented_outline_image = synthetic_map.get_fragmented_outline_image((width * height) // benchmark_pixels_per_fragment, synthetic_map_seed)
+
+    stages = {"fill" : (fill_stage, outline_image),
+              "fill_consistency" : (fill_consistency_stage, outline_image),
+              "fragments" : (fragments_stage, fragmented_outline_image),
+              "assign" : (assign_stage, province_image, outline_image, definitions_text),
+              "definitions" : (definitions_stage, province_image, synthetic_map.terrain_image, definitions_text),
+              "validate" : (validate_stage, province_image)}
+
+    measurements = {}
+    for stage_name in stages:
+        result, seconds, peak_bytes = measure(stage_name, *stages[stage_name])
+        measurements[stage_name] = {"seconds" : seconds, "peak_bytes" : peak_bytes, "result" : result}
+        print("  {:<12} {:>10.3f}s {:>10.1f} MB".format(stage_name, seconds, peak_bytes / 1024 ** 2))
+
+    return measurements
+
+# Print every size whose serial and parallel fills gave different colors. Returns the number of sizes that did.
+def check_fill_consistency(results):
+    mismatch_count = 0
+    for size_name in results:
+        if not results[size_name]["fill_consistency"]["result"]["matches_serial"]:
+            print("{:<12} Filling states across {} processes gave different colors to filling them one at a time.".format(size_name, consistency_process_count))
+            mismatch_count += 1
+    return mismatch_count
+
+# Print every size and undetermined_pixel_handling under which resolving fragments from labels gave different colors to resolving them one pixel at a time. Returns the number of times it did.
+def check_fragment_resolution(results):
+    mismatch_count = 0
+    for size_name in results:
+        fragment_results = results[size_name]["fragments"]["result"]
+        for handling_name in fragment_results:
+            if not fragment_results[handling_name]["matches_per_pixel"]:
+                print("{:<12} With {}, resolving fragments from labels gave different colors to resolving them one pixel at a time.".format(size_name, handling_name.replace("handling_", "undetermined_pixel_handling ")))
+                mismatch_count += 1
+    return mismatch_count
+
+# Compare the argued results with the baseline results, printing any stages that got slower or whose results changed. Returns the number of stages that did either.
+def compare_with_baseline(results, baseline):
+    issue_count = 0
+    for size_name in results:
+        if size_name not in baseline:
+            print("No baseline for size {}.".format(size_name))
+            continue
+
+        for stage_name in results[size_name]:
+            if stage_name not in baseline[size_name]:
+                continue
+            current = results[size_name][stage_name]
+            previous = baseline[size_name][stage_name]
+
+            speedup = previous["seconds"] / current["seconds"] if current["seconds"] > 0 else float("inf")
+            memory_ratio = current["peak_bytes"] / previous["peak_bytes"] if previous["peak_bytes"] > 0 else 1
+            print("{:<12} {:<12} {:>8.2f}x faster, {:>6.2f}x the peak memory".format(size_name, stage_name, speedup, memory_ratio))
+
+            if current["seconds"] > previous["seconds"] * benchmark_slowdown_tolerance:
+                print("  Regression: this stage took {:.3f}s, against a baseline of {:.3f}s.".format(current["seconds"], previous["seconds"]))
+                issue_count += 1
+            if current["result"] != previous["result"]:
+                print("  Changed result: {} (baseline: {})".format(current["result"], previous["result"]))
+                issue_count += 1
+
+    return issue_count
+
+### Main Program ###
+if __name__ == "__main__":
+    parse_arguments("Benchmark each Provincial script on synthetic maps of several sizes, and compare the results with a saved baseline.")
+    # Every stage is measured as a span, with its peak memory traced. With '--report', the spans within each stage are written to the stage report too.
+    start_recording(True)
+
+    results = {}
+    for width, height in benchmark_sizes:
+        size_name = "{}x{}".format(width, height)
+        print("Benchmarking a {} synthetic map ...".format(size_name))
+        with timed_span(size_name):
+            results[size_name] = benchmark_size(width, height)
+
+    os.makedirs(benchmark_output_dir, exist_ok = True)
+    results_dir = os.path.join(benchmark_output_dir, time.strftime("Results-%Y%m%d-%H%M%S.json"))
+    with open(results_dir, "w+") as results_file:
+        json.dump(results, results_file, indent = 4)
+    print("\nResults written to '{}'.".format(results_dir))
+
+    # Serial and parallel fills must always agree, as must the two ways of resolving fragments, whether or not there's a baseline to compare with.
+    issue_count = check_fill_consistency(results) + check_fragment_resolution(results)
+    if not os.path.exists(benchmark_baseline_dir):
+        with open(benchmark_baseline_dir, "w+") as baseline_file:
+            json.dump(results, baseline_file, indent = 4)
+        print("No baseline was found, so these results have been saved as the baseline at '{}'.".format(benchmark_baseline_dir))
+    else:
+        with open(benchmark_baseline_dir, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        print("\nComparing with the baseline at '{}' ...".format(benchmark_baseline_dir))
+        issue_count += compare_with_baseline(results, baseline)
+    print("\n{} stages regressed or changed their result.".format(issue_count) if issue_count > 0 else "\nNo stages regressed or changed their result.")
+    sys.exit(1 if issue_count > 0 else 0)
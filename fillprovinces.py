@@ -3,66 +3,70 @@
 
 # The Algorithm for filling in provinces on a province map with random colors.
 
-import sys
 import traceback
 import numpy as numpy
-import random as random
 import colorsys as colorsys
-import time
-from numpy import arange, logical_and, where
-from skimage import data, io
-from skimage.segmentation import flood, flood_fill
-import matplotlib.pyplot as pyplot
-from matplotlib import animation as animation
-import provincialutils as provutils
+import os
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
+import json
+from scipy import ndimage
+import provincialprofiler
 from provincialutils import *
+from provincialcache import *
+from provincialcli import parse_arguments
+from provincialoverlay import stamp_dots
+from provincialprofiler import timed, timed_span, count
 from provincialsettings import *
-import json
 
 ### Function Definitions ###
-# Uses the province map, which should be an image defining province and state borders, to fill out provinces with a unique color (on the province output array).
+# Uses a state's area on the province map, which should be an image defining province and state borders, to fill out provinces with a unique color (on the province output array).
+# The state's provinces are colored as variants of the palette color, which is chosen by get_state_palette_color if not specified.
 # Returns false if the operation failed.
-def fill_state(province_guide, province_output, state_color):
+@timed()
+def fill_state(state_area, province_output, palette_color = None):
+    state_color = state_area.color
     try:
-        state_mask, border_mask, x_min, y_min, x_max, y_max = get_state_mask(province_guide, state_color)
+        state_mask, border_mask = state_area.state_mask, state_area.border_mask
+        x_min, y_min, x_max, y_max = state_area.bounds()
 
         # Define the area that we're operating on by cropping the entire image to the bounds of where the defining state key can be found, for optimisation.
         state_view = province_output[y_min:y_max + 1, x_min:x_max + 1]
 
-        province_masks, province_origins, undetermined_mask = get_provinces(numpy.logical_and(state_mask, ~border_mask), min_province_pixels)
+        province_areas, province_origins, undetermined_mask = get_provinces(numpy.logical_and(state_mask, ~border_mask), min_province_pixels)
 
-        undetermined_province_masks = None
+        undetermined_province_areas = None
         if undetermined_mask is not None:
-            undetermined_province_masks, undetermined_origins, undetermined_second_mask = get_provinces(undetermined_mask, 0, 2)
+            undetermined_province_areas, undetermined_origins, _ = get_provinces(undetermined_mask, 0, 2)
 
-        palette_color = None
-        if random_state_palette_colors:
-            palette_color = get_random_color()
-        else:
-            palette_color = state_color
+        if palette_color is None:
+            palette_color = get_state_palette_color(state_color)
+        count("states filled")
+        count("provinces filled", len(province_areas))
 
-        for p in province_masks:
+        for p in province_areas:
             # Fill each province with a random color.
             new_prov_col = get_random_color(palette_color)
 
             if new_prov_col == ignore_col:
-                raise Exception("Error: A province was almost filled with the ignore color {}! This shouldn't be possible, but I saw it happen once so I added this safeguard. Please report it to the tool author. Aborting the operation.".format(ignorecol))
+                raise Exception("Error: A province was almost filled with the ignore color {}! This shouldn't be possible, but I saw it happen once so I added this safeguard. Please report it to the tool author. Aborting the operation.".format(ignore_col))
             
-            state_view[numpy.where(p)] = new_prov_col
-            used_cols.add(tuple(new_prov_col))
+            p.paint(state_view, new_prov_col)
+            used_cols.add(pack_color(new_prov_col))
             
             # Register an animation frame after each painted province.
-            register_anim_frame(province_output)
+            register_anim_frame(province_output, state_area.slices)
 
-        if undetermined_province_masks is not None:
-            for u in undetermined_province_masks:
+        if undetermined_province_areas is not None:
+            for u in undetermined_province_areas:
                 # For now, treat the stray province pieces as regular provinces (this allows us to fill in the borders nicely), but they bay be filled with the undetermined col later
                 # depending on the user settings.
                 new_prov_col = get_random_color(palette_color)
-                state_view[numpy.where(u)] = new_prov_col
-                used_cols.add(tuple(new_prov_col))
+                u.paint(state_view, new_prov_col)
+                used_cols.add(pack_color(new_prov_col))
         
-        stray_border_origins = clean_up_borders(state_view, state_mask, border_mask, state_color)
+        stray_border_origins = clean_up_borders(state_view, state_mask, border_mask, province_output, state_area.slices)
         if stray_border_origins is not None:
             for s in stray_border_origins:
                 s[0] = s[0] + y_min
@@ -70,35 +74,22 @@ def fill_state(province_guide, province_output, state_color):
 
             global stray_border_fragments
 
+            count("stray border fragments", len(stray_border_origins))
             stray_border_fragments = numpy.concatenate((stray_border_fragments, stray_border_origins))
 
         # Decided what to do with the province fragments which were so small they were probably meant to be part of a bigger province.
-        if undetermined_province_masks is not None:
-            for u in undetermined_origins:
-                mode_col = None
-
-                post_border_cleanup_fragment = logical_and.reduce(state_view == state_view[u[0],u[1]], axis = -1)
-
-                state_view[post_border_cleanup_fragment] = (255, 0, 255)
-                
-                if undetermined_pixel_handling != 0:
-                    mode_col = get_mode_neighbors_of_area(post_border_cleanup_fragment, state_view, state_mask, undetermined_pixel_handling == 1)
-
-                if mode_col is not None:
-
-                    state_view[numpy.where(post_border_cleanup_fragment)] = mode_col
-                else:
-                    state_view[numpy.where(post_border_cleanup_fragment)] = undetermined_col
-
-                    # Coordinates need to be in global array space.
-                    # Don't forget, axes are [0] = y, [1] = x in numpy ...
-                    u[0]= u[0] + y_min 
-                    u[1]= u[1] + x_min
-                    global undetermined_fragments
-                    undetermined_fragments = numpy.concatenate((undetermined_fragments, [u]), axis = 0)
+        if undetermined_province_areas is not None:
+            count("undetermined fragments resolved", len(undetermined_origins))
+            for u in resolve_fragments(state_view, state_mask, undetermined_origins):
+                # Coordinates need to be in global array space.
+                # Don't forget, axes are [0] = y, [1] = x in numpy ...
+                u[0]= u[0] + y_min 
+                u[1]= u[1] + x_min
+                global undetermined_fragments
+                undetermined_fragments = numpy.concatenate((undetermined_fragments, [u]), axis = 0)
 
         # Register the final animation frame.
-        register_anim_frame(province_output)
+        register_anim_frame(province_output, state_area.slices)
         
     except Exception as exc:
         print("Error: Failure while attempting to fill the state of color '{}':".format(state_color) + str(exc))
@@ -108,149 +99,367 @@ def fill_state(province_guide, province_output, state_color):
 
     return True
 
-# Given a defined area in an array of colors, go through the pixels neiughboring that area (von-Neumann neighborhood) and find the most prevalant color.
-# If check_for_ubiquity, will instead return the neighboring col if that color is the ONLY color to neighbor the area, otherwise returns None.
-def get_mode_neighbors_of_area(area_mask, state_view, state_mask, check_for_ubiquity = False):
-    neighboring_cols = {}
-    highest_count = 0
-    mode_col = None
-    for y in range(state_view.shape[0]):
-        for x in range(state_view.shape[1]):
-            tuple_col = tuple(state_view[y, x])
-
-            if (state_mask[y, x] and not area_mask[y, x] and
-                (y > 0 and area_mask[y - 1, x]
-                or
-                (y < state_view.shape[0] - 1 and area_mask[y + 1, x])
-                or
-                x > 0 and area_mask[y, x - 1]
-                or
-                x < state_view.shape[1] - 1 and area_mask[y, x + 1])):
-                
-                # If checking for ubiquity, and found a different color, return None.
-                if check_for_ubiquity and mode_col is not None and tuple_col != mode_col:
-                    return None
-                
-                if tuple_col not in neighboring_cols:
-                    neighboring_cols[tuple_col] = 0
-                neighboring_cols[tuple_col] += 1
-                if neighboring_cols[tuple_col] > highest_count:
-                    highest_count += 1
-                    mode_col = tuple_col
-
-    return mode_col
+# Get the base color that a state's province colors are variants of.
+def get_state_palette_color(state_color):
+    if random_state_palette_colors:
+        return get_random_color()
+    else:
+        return state_color
+
+# Fill every state of the argued keys, either one after the other or across several processes depending on fill_process_count.
+# Returns the number of states that failed to fill.
+@timed()
+def fill_states(state_areas, state_keys, province_output):
+    process_count = fill_process_count if fill_process_count > 0 else os.cpu_count()
+    if process_count > 1 and record_animation:
+        print("\nAnimation frames must be recorded in order, so states will be filled one at a time rather than across {} processes.".format(process_count))
+        process_count = 1
+
+    if process_count > 1 and len(state_keys) > 1:
+        return fill_states_in_parallel(state_areas, state_keys, province_output, min(process_count, len(state_keys)))
+
+    state_results = {}
+    progress = ProgressReporter("Filling states", len(state_keys))
+    for key in state_keys:
+        state_results[key] = fill_state_alone(state_areas[key], province_output)
+        progress.step()
+    progress.finish()
+    return merge_state_results(state_areas, state_keys, province_output, state_results)
+
+# Start the random sequence that a state's colors are drawn from. Each state has its own sequence, seeded by the fill seed and the state's color, and its own palette pools,
+# so a state is given the same colors whether states are filled one after the other or across processes, and whichever states were filled before it.
+def seed_state_colors(state_area):
+    global color_rng, color_pools
+    color_rng = numpy.random.default_rng([fill_seed, pack_color(state_area.color)])
+    color_pools = {}
+
+# Fill a single state as though it were the first state to be filled: it only avoids the colors that were used before filling began, and its own. Its colors are then the same
+# whichever states were filled before it, and in whichever process, and any it shares with another state are replaced by merge_state_results.
+# Returns whether it succeeded, along with its palette color, the colors it used, and its undetermined and stray border fragments.
+def fill_state_alone(state_area, province_output):
+    global used_cols, undetermined_fragments, stray_border_fragments
+    initial_used_cols, previous_undetermined_fragments, previous_stray_border_fragments = used_cols, undetermined_fragments, stray_border_fragments
+    used_cols = set(initial_used_cols)
+    undetermined_fragments = numpy.empty((0, 2), dtype = int)
+    stray_border_fragments = numpy.empty((0, 2), dtype = int)
+    try:
+        seed_state_colors(state_area)
+        palette_color = get_state_palette_color(state_area.color)
+        success = fill_state(state_area, province_output, palette_color)
+        return success, palette_color, list(used_cols - initial_used_cols), undetermined_fragments, stray_border_fragments
+    finally:
+        used_cols, undetermined_fragments, stray_border_fragments = initial_used_cols, previous_undetermined_fragments, previous_stray_border_fragments
+
+# Fill the argued states using a pool of processes, which all write into the same output image in shared memory. Each state only writes within its own state mask, so no two processes write to the same pixel.
+# Returns the number of states that failed to fill.
+def fill_states_in_parallel(state_areas, state_keys, province_output, process_count):
+    print("Filling states across {} processes ...".format(process_count))
+    # The largest states are filled first, so that a big state isn't left running on its own at the end.
+    ordered_keys = sorted(state_keys, key = lambda k: state_areas[k].state_mask.size, reverse = True)
+
+    # An output that's memory-mapped from its image file (when processing in tiles) is shared by mapping the same file in every process. Otherwise, it's copied into shared memory.
+    output_file = province_output.filename if isinstance(province_output, numpy.memmap) else None
+    output_memory = None if output_file is not None else shared_memory.SharedMemory(create = True, size = province_output.nbytes)
+    try:
+        if output_memory is not None:
+            shared_output = numpy.ndarray(province_output.shape, dtype = province_output.dtype, buffer = output_memory.buf)
+            shared_output[:] = province_output
+
+        worker_arguments = (output_memory.name if output_memory is not None else None, output_file, province_output.shape, province_output.dtype, used_cols, fill_seed,
+                            provincialprofiler.recording, provincialprofiler.is_tracing_memory())
+        state_results = {}
+        progress = ProgressReporter("Filling states", len(ordered_keys))
+        with multiprocessing.Pool(process_count, initializer = start_fill_worker, initargs = worker_arguments) as pool:
+            for key, state_result in pool.imap_unordered(fill_state_in_worker, [(k, state_areas[k]) for k in ordered_keys]):
+                state_results[key] = state_result
+                progress.step()
+        progress.finish()
+
+        if output_memory is not None:
+            province_output[:] = shared_output
+            del shared_output
+    finally:
+        if output_memory is not None:
+            output_memory.close()
+            output_memory.unlink()
+
+    for key in state_keys:
+        provincialprofiler.merge_records(state_results[key][-1])
+        state_results[key] = state_results[key][:-1]
+    return merge_state_results(state_areas, state_keys, province_output, state_results)
+
+# Gather the results of every filled state (see fill_state_alone) in the order of the argued keys. Since each state was filled on its own, any color that was chosen by more than one
+# state is replaced in all but the first of those states, so no province color is ever duplicated. Replacements are drawn from each state's own random sequence, after every state before it.
+# Returns the number of states that failed to fill.
+def merge_state_results(state_areas, state_keys, province_output, state_results):
+    global undetermined_fragments, stray_border_fragments
+
+    error_count = 0
+    for key in state_keys:
+        success, palette_color, state_cols, state_undetermined_fragments, state_stray_border_fragments = state_results[key]
+        if not success:
+            error_count = error_count + 1
+
+        duplicate_cols = [c for c in state_cols if c in used_cols]
+        used_cols.update(c for c in state_cols if c not in used_cols)
+
+        if len(duplicate_cols) > 0:
+            state_area = state_areas[key]
+            state_view = province_output[state_area.slices]
+            state_view_keys = pack_colors(state_view)
+            count("duplicate colors replaced", len(duplicate_cols))
+            seed_state_colors(state_area)
+            for duplicate_col in sorted(duplicate_cols):
+                new_prov_col = get_random_color(palette_color)
+                state_view[(state_view_keys == duplicate_col) & state_area.state_mask] = new_prov_col
+                used_cols.add(pack_color(new_prov_col))
+            register_anim_frame(province_output, state_area.slices)
+
+        undetermined_fragments = numpy.concatenate((undetermined_fragments, state_undetermined_fragments))
+        stray_border_fragments = numpy.concatenate((stray_border_fragments, state_stray_border_fragments))
+
+    return error_count
+
+# Set up a fill process, attaching it to the shared output image (either a block of shared memory or an image file). The process starts with the colors that were used before filling began.
+# If the main process is recording its stages, so does the fill process, handing its records back with each state.
+def start_fill_worker(output_name, output_file, output_shape, output_dtype, initial_used_cols, initial_fill_seed, record_stages, trace_memory):
+    global worker_output_memory, worker_output, used_cols, fill_seed
+
+    if output_file is not None:
+        worker_output = open_bmp(output_file, "r+")
+    else:
+        worker_output_memory = shared_memory.SharedMemory(name = output_name)
+        worker_output = numpy.ndarray(output_shape, dtype = output_dtype, buffer = worker_output_memory.buf)
+
+    used_cols = set(initial_used_cols)
+    fill_seed = initial_fill_seed
+    if record_stages:
+        provincialprofiler.start_recording(trace_memory)
+
+# Fill a single state in a fill process. Returns the state's key and the results of fill_state_alone, followed by the stages recorded while filling it.
+def fill_state_in_worker(task):
+    key, state_area = task
+    return key, fill_state_alone(state_area, worker_output) + (provincialprofiler.take_records(),)
+
+# Get a hash of a state's area on the guide, which changes whenever the state's bounds, its borders or the pixels within them change.
+def get_state_area_hash(state_area):
+    area_hash = hashlib.sha1(numpy.array([state_area.slices[0].start, state_area.slices[0].stop, state_area.slices[1].start, state_area.slices[1].stop]).tobytes())
+    area_hash.update(numpy.packbits(state_area.state_mask).tobytes())
+    area_hash.update(numpy.packbits(state_area.border_mask).tobytes())
+    return area_hash.hexdigest()
+
+# Get the settings that change how a state is filled. If any of these differ from the previous fill, none of its states can be kept.
+def get_fill_settings():
+    return [list(ignore_col), list(paint_over_col), list(undetermined_col), min_province_pixels, random_state_palette_colors, hue_variation, sat_variation, val_variation,
+            undetermined_pixel_handling, palette_pool_steps, random_seed]
+
+# Find the states that haven't changed since the previous fill, if incremental_fill is set and the previous output is still the one that the fill record describes.
+# Returns the previous output and fill record, along with the keys of the unchanged states. If every state must be filled, returns None for the output and record.
+@timed()
+def find_unchanged_states(state_hashes, output_shape):
+    if not incremental_fill or not os.path.exists(fill_record_dir) or not os.path.exists(filled_provinces_dir):
+        return None, None, []
+
+    with open(fill_record_dir, "r") as record_file:
+        fill_record = json.load(record_file)
+
+    if fill_record["settings"] != get_fill_settings() or fill_record["output_hash"] != get_file_hash(filled_provinces_dir):
+        print("\nThe fill settings or {} have changed since the previous fill, so every state will be filled.".format(filled_provinces_dir))
+        return None, None, []
+
+    previous_output = read_map_image(filled_provinces_dir)[:, :, 0:3]
+    if previous_output.shape != output_shape:
+        print("\n{} is a different size to the province guide, so every state will be filled.".format(filled_provinces_dir))
+        return None, None, []
+
+    previous_hashes = fill_record["states"]
+    unchanged_keys = [k for k in state_hashes if previous_hashes.get(str(pack_color(k))) == state_hashes[k]]
+    return previous_output, fill_record, unchanged_keys
+
+# Copy the argued unchanged states from the previous output into the province output, marking their colors as used and keeping the fragments that were found within them.
+@timed()
+def keep_unchanged_states(previous_output, fill_record, unchanged_keys, state_areas, province_output):
+    global undetermined_fragments, stray_border_fragments
+
+    kept_fragments = {}
+    for fragments_name in ("undetermined_fragments", "stray_border_fragments"):
+        kept_fragments[fragments_name] = (numpy.array(fill_record[fragments_name], dtype = int).reshape(-1, 2), [])
+
+    # Each state is copied within its own bounds, so that no mask the size of the whole map is needed.
+    for key in unchanged_keys:
+        state_area = state_areas[key]
+        state_pixels = previous_output[state_area.slices][state_area.state_mask]
+        province_output[state_area.slices][state_area.state_mask] = state_pixels
+        used_cols.update(numpy.unique(pack_colors(state_pixels)).tolist())
+
+        for fragments, state_fragments in kept_fragments.values():
+            local_fragments = fragments - [state_area.slices[0].start, state_area.slices[1].start]
+            in_bounds = ((local_fragments >= 0) & (local_fragments < state_area.state_mask.shape)).all(axis = 1)
+            in_state = numpy.zeros(len(fragments), dtype = bool)
+            in_state[in_bounds] = state_area.state_mask[local_fragments[in_bounds, 0], local_fragments[in_bounds, 1]]
+            state_fragments.append(fragments[in_state])
+    used_cols.discard(pack_color(undetermined_col))
+
+    undetermined_fragments = numpy.concatenate([undetermined_fragments] + kept_fragments["undetermined_fragments"][1])
+    stray_border_fragments = numpy.concatenate([stray_border_fragments] + kept_fragments["stray_border_fragments"][1])
+
+# Write the fill record describing the output that was just saved, so that the next fill can keep the states that haven't changed.
+@timed()
+def write_fill_record(state_hashes):
+    fill_record = {"settings" : get_fill_settings(), "output_hash" : get_file_hash(filled_provinces_dir),
+                   "states" : {str(pack_color(k)) : state_hashes[k] for k in state_hashes},
+                   "undetermined_fragments" : undetermined_fragments.tolist(), "stray_border_fragments" : stray_border_fragments.tolist()}
+    with open(fill_record_dir, "w+") as record_file:
+        json.dump(fill_record, record_file)
+
+# Assign each of a state's undetermined fragments to a neighboring province, or fill it with the undetermined_col, depending on undetermined_pixel_handling.
+# Fragments are resolved one after the other, so a fragment sees the colors given to the fragments before it. A fragment is every pixel sharing the current color of its origin, which
+# includes any earlier fragment that took its color. Its ring (the von-Neumann neighbors of the fragment within the state) is counted pixel by pixel, and a tie goes to the color that
+# reached the highest count first, going through the ring in row-major order.
+# The state view is labelled once, and each label's current color is tracked as fragments are recolored, so every fragment is only searched for within its own bounding box.
+# Returns the origins of the fragments that were filled with the undetermined_col.
+@timed()
+def resolve_fragments(state_view, state_mask, fragment_origins):
+    # The state view is only as large as the state's bounds, so it's labelled whole rather than one band of rows at a time like a map.
+    label_keys, view_labels = numpy.unique(pack_colors(state_view).ravel(), return_inverse = True)
+    outside_label = len(label_keys)
+    view_labels = numpy.where(state_mask, view_labels.reshape(state_mask.shape), outside_label)
+    label_keys = numpy.append(label_keys.astype(numpy.int64), -1)  # The current color of each label, which changes as fragments are recolored. Pixels outside the state have no color.
+    label_slices = ndimage.find_objects(view_labels + 1)    # find_objects ignores label 0, so shift every label up by one.
+
+    undetermined_origins = []
+    for u in fragment_origins:
+        fragment_labels = numpy.flatnonzero(label_keys == label_keys[view_labels[u[0], u[1]]])
+
+        # The fragment's bounds are grown by a pixel so that they hold its ring.
+        y_min = min(label_slices[l][0].start for l in fragment_labels)
+        y_max = max(label_slices[l][0].stop for l in fragment_labels)
+        x_min = min(label_slices[l][1].start for l in fragment_labels)
+        x_max = max(label_slices[l][1].stop for l in fragment_labels)
+        fragment_slices = (slice(max(y_min - 1, 0), y_max + 1), slice(max(x_min - 1, 0), x_max + 1))
+        local_labels = view_labels[fragment_slices]
+        fragment_mask = numpy.isin(local_labels, fragment_labels)
+
+        mode_key = None
+        if undetermined_pixel_handling != 0:
+            ring_mask = get_cardinal_dilation(fragment_mask) & ~fragment_mask & (local_labels != outside_label)
+            mode_key = get_mode_ring_key(label_keys[local_labels[ring_mask]], undetermined_pixel_handling == 1)
+
+        if mode_key is not None:
+            state_view[fragment_slices][fragment_mask] = unpack_color(mode_key)
+            label_keys[fragment_labels] = mode_key
+        else:
+            state_view[fragment_slices][fragment_mask] = undetermined_col
+            label_keys[fragment_labels] = pack_color(undetermined_col)
+            undetermined_origins.append(u)
 
-# Iterate through all province border pixels, assigning them the color of neighboring provinces until none are left.
-# A border pixel is assigned to a province based on which province has the most pixels neighboring it. This can be done over several iterations.
-def clean_up_borders(state_view, state_mask, border_mask, state_color):
-    waning_border_mask = border_mask.copy() # We need a copy of the border mask that loses pixels over the course of the operation.
+    return undetermined_origins
+
+# Find the mode of the argued ring keys, which are in row-major order. A tie goes to the key that reached the highest count first, which is the one whose last pixel comes first.
+# If check_for_ubiquity, the ring must only hold one key to have a mode. Returns None if there's no mode.
+def get_mode_ring_key(ring_keys, check_for_ubiquity = False):
+    if len(ring_keys) == 0:
+        return None
+
+    keys, key_indices, key_counts = numpy.unique(ring_keys, return_inverse = True, return_counts = True)
+    if check_for_ubiquity and len(keys) > 1:
+        return None
 
-    filled_mask = state_mask & ~border_mask # A mask tracking the pixels which have been filled, either before or during the border cleanup.
+    last_positions = numpy.zeros(len(keys), dtype = numpy.int64)
+    numpy.maximum.at(last_positions, key_indices, numpy.arange(len(ring_keys)))
+    is_mode = key_counts == key_counts.max()
+    return int(keys[numpy.argmin(numpy.where(is_mode, last_positions, len(ring_keys)))])
 
-    border_coords = numpy.where(border_mask)
-    leftover_coords = [[],[]]
+# Iterate through all province border pixels, assigning them the color of neighboring provinces until none are left.
+# A border pixel is assigned to a province based on which province has the most pixels neighboring it. This can be done over several iterations.
+# Each iteration visits the remaining border pixels in row-major order, and colors each one as soon as it's visited, so a pixel can take its color from a border pixel that was colored
+# earlier in the same iteration. Colors are tracked in flat lists rather than on the state view, so that each visit only costs a few list lookups.
+@timed()
+def clean_up_borders(state_view, state_mask, border_mask, province_output, view_region = None):
+    border_coords = numpy.nonzero(border_mask & state_mask)
     stray_borders_origins = None
 
     if len(border_coords[0]) == 0:
         raise Exception("No border pixels were found in the specified border mask.")
-        return
-    
-    previous_leftover = len(border_coords[0])
-
-    while len(border_coords[0]) > 0:
-        for b in range(len(border_coords[0])):
-            coord = numpy.array([border_coords[0][b], border_coords[1][b]])
 
+    # Pixels are referred to by their index in the flattened state view. Each list has an extra pixel at the end, which is never filled, and which any neighbor beyond the view's bounds refers to.
+    border_indices = numpy.ravel_multi_index(border_coords, state_mask.shape).tolist()
+    neighbor_indices = get_neighbor_indices(border_coords, state_mask.shape).tolist()
+    filled = bytearray((state_mask & ~border_mask).ravel().tobytes() + b"\0")  # Tracks the pixels which have been filled, either before or during the border cleanup.
+    native = bytes(filled)  # The pixels that were filled as part of a province, rather than as a recolored border pixel.
+    view_keys = pack_colors(state_view).ravel().tolist() + [0]
+
+    remaining = list(range(len(border_indices)))  # The border pixels that are still waiting to be colored, in row-major order.
+    while len(remaining) > 0:
+        leftover = []
+        for b in remaining:
+            neighbors = neighbor_indices[b]
             # Each iteration, color any pixels that are immediately adjacent to pixels that have already been colored. This helps avoid accidentally creating
             # 'X' crossings where a pixel may not be von-Neumann connected to the area that it drew its color from.
-            if has_neighbor_in_mask(coord, filled_mask):
-                mode_color = get_mode_neighbor(coord, state_view, state_mask, border_mask, waning_border_mask)
-                
-                if mode_color == None:
-                    leftover_coords[0].append(coord[0])
-                    leftover_coords[1].append(coord[1])
-                else:
-                    state_view[coord[0], coord[1]] = mode_color
-                    waning_border_mask[coord[0], coord[1]] = False
-                    filled_mask[coord[0], coord[1]] = True
+            if filled[neighbors[0]] or filled[neighbors[2]] or filled[neighbors[4]] or filled[neighbors[6]]:
+                view_keys[border_indices[b]] = get_mode_neighbor_key(neighbors, view_keys, filled, native)
+                filled[border_indices[b]] = 1
             else:
-                leftover_coords[0].append(coord[0])
-                leftover_coords[1].append(coord[1])
+                leftover.append(b)
 
-        # If, after an iteration, the number of leftover coordinates hasn't changed, it means we've found some stray border pixels that have no associated white pixels (probably very small islands).
-        # Mark their locations for debugging purposes, and fill them in the undetermined_col.
-        if len(leftover_coords[0]) == previous_leftover:
-            leftover_pixels_mask = numpy.zeros(state_mask.shape, dtype = bool)
-            leftover_pixels_mask[leftover_coords[0], leftover_coords[1]] = True
+        colored = numpy.setdiff1d(remaining, leftover, assume_unique = True)
+        state_view[border_coords[0][colored], border_coords[1][colored]] = unpack_colors(numpy.array([view_keys[border_indices[b]] for b in colored], dtype = numpy.uint32))
 
-            stray_borders_masks, stray_borders_origins, undetermined_mask = get_provinces(leftover_pixels_mask, 0, 2)
-
-            state_view[leftover_coords[0], leftover_coords[1]] = undetermined_col
+        # If an iteration colors no pixels, the remaining border pixels have no associated white pixels (probably very small islands).
+        # Mark their locations for debugging purposes, and fill them in the undetermined_col.
+        if len(colored) == 0:
+            stray_borders_mask = numpy.zeros(state_mask.shape, dtype = bool)
+            stray_borders_mask[border_coords[0][leftover], border_coords[1][leftover]] = True
+            stray_borders_labels, stray_borders_counts, stray_borders_origins = label_areas(stray_borders_mask, 2)
+            state_view[stray_borders_mask] = undetermined_col
             break
 
-        previous_leftover = len(leftover_coords[0])
-        border_coords = numpy.array(leftover_coords)
-        leftover_coords = [[],[]]
+        remaining = leftover
 
         # Register an animation frame after every border-cleanup iteration.
-        register_anim_frame(province_output)
+        register_anim_frame(province_output, view_region)
 
     return stray_borders_origins
 
-# Determine if the coordinate has a von Neumann neighbor that is true in the argued mask.
-def has_neighbor_in_mask(coordinate, mask):
-    for d in range(0, len(directions), 2):
-        direction = directions[d]
-        neighbor = numpy.array([coordinate[0] + direction[0], coordinate[1] + direction[1]])
-
-        if neighbor[0] >= 0 and neighbor[0] < mask.shape[0] and neighbor[1] >= 0 and neighbor[1] < mask.shape[1]:
-            if mask[neighbor[0], neighbor[1]]:
-                return True
-    return False
-    
-
-# Find the most common potential color (i.e. not a key color) neighboring the border pixel at this coordinate.
-# Special priority is given to pixels that aren't just a border pixel that's been recolored on a previous iteration, but are an original province-pixel instead
-def get_mode_neighbor(coordinate, state_view, state_mask, border_mask, remaining_border_mask):
-    neighbor_cols = {}
-    neighboring_native_col = {}
-    current_mode = None
-
+# Get the flat index of every neighbor of each of the argued coordinates, within a view of the argued shape, with the neighbors in the order of 'directions'.
+# Neighbors beyond the view's bounds are given the index -1.
+def get_neighbor_indices(coords, shape):
+    neighbor_indices = numpy.empty((len(coords[0]), len(directions)), dtype = numpy.int64)
     for d in range(len(directions)):
-        direction = directions[d]
-        neighbor_coord = numpy.array([coordinate[0] + direction[0], coordinate[1] + direction[1]])
-
-        is_cardinal = d % 2 == 0
-    
-        # If this neighboring pixel is within the state view's bounds ...
-        # and is not a (currently unpainted) border pixel, add its color to the mode count.
-        if (neighbor_coord[0] >= 0 and neighbor_coord[0] < state_view.shape[0]
-            and neighbor_coord[1] >= 0 and neighbor_coord[1] < state_view.shape[1]
-            and state_mask[neighbor_coord[0], neighbor_coord[1]] and not remaining_border_mask[neighbor_coord[0], neighbor_coord[1]]):
-
-            neighbor_col = tuple(state_view[neighbor_coord[0], neighbor_coord[1]])
-
-            if neighbor_col not in neighbor_cols:
-                neighbor_cols[neighbor_col] = 0
-                neighboring_native_col[neighbor_col] = False
-
-            # Cardinal neighbors are worth more than diagonal ones.
-            if is_cardinal:
-                neighbor_cols[neighbor_col] += 2;
-            else:
-                neighbor_cols[neighbor_col] += 1;
-            
-            if not border_mask[neighbor_coord[0], neighbor_coord[1]] and is_cardinal:
-                neighboring_native_col[neighbor_col] = True
-    
-    # If the neighboring pixel is of a province and not a recoloured border pixel, mark it as native-colored, giving it a priority.
-    for c in neighbor_cols:
-        if current_mode is None:
-            current_mode = c
-        elif neighboring_native_col[c] and not neighboring_native_col[current_mode] or neighbor_cols[c] > neighbor_cols[current_mode]:
-            current_mode = c
-    
-    return current_mode
+        neighbor_y = coords[0] + directions[d][0]
+        neighbor_x = coords[1] + directions[d][1]
+        in_bounds = (neighbor_y >= 0) & (neighbor_y < shape[0]) & (neighbor_x >= 0) & (neighbor_x < shape[1])
+        neighbor_indices[:, d] = numpy.where(in_bounds, neighbor_y * shape[1] + neighbor_x, -1)
+    return neighbor_indices
+
+# Get a mask of every pixel with a von-Neumann neighbor that is true in the argued mask.
+def get_cardinal_dilation(mask):
+    dilation = numpy.zeros(mask.shape, dtype = bool)
+    dilation[1:, :] |= mask[:-1, :]
+    dilation[:-1, :] |= mask[1:, :]
+    dilation[:, 1:] |= mask[:, :-1]
+    dilation[:, :-1] |= mask[:, 1:]
+    return dilation
+
+# Find the most common color (as a packed key) among the filled neighbors of a border pixel, whose neighbors' flat indices are argued in the order of 'directions'.
+# Cardinal neighbors are worth 2 and diagonal ones 1. Special priority is given to colors that neighbor the pixel cardinally with an original province-pixel, rather than just with a border pixel
+# that's been recolored. Colors are considered in the order that they're first met going around the pixel, and a later color takes over as the mode if it has priority over the current
+# mode or has a higher count.
+def get_mode_neighbor_key(neighbors, view_keys, filled, native):
+    key_counts = {}
+    native_keys = set()
+    for neighbor, weight in zip(neighbors, direction_weights):
+        if filled[neighbor]:
+            key = view_keys[neighbor]
+            key_counts[key] = key_counts.get(key, 0) + weight
+            if weight == 2 and native[neighbor]:
+                native_keys.add(key)
+
+    mode_key = None
+    for key in key_counts:
+        if mode_key is None or key in native_keys and mode_key not in native_keys or key_counts[key] > key_counts[mode_key]:
+            mode_key = key
+    return mode_key
 
 # Identify the palette colour assigned to a state by searching for its base palette marker.
 # If the marker is not found, provide a random color instead.
@@ -286,194 +495,297 @@ def get_palette_color(state_view, state_mask):
     
     return palette_base
 
-# Get a random color that doesn't equal any of the key colors used to operate on the image.
-# If palette_base is specified, the random color will be a variant of this color.
-def get_random_color(palette_base = None, disallowed_values = []):
-    generation_attempts = random_col_generation_attempts
-    current_attempt = 0
-
-    for i in range(generation_attempts):
-        current_attempt = i
-        generated_color = None
-        
-        if palette_base is None:
-            generated_color = [random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)]
-        else:
-            # If we want to deal with color generation in Hue-Sat-Value, we need to use python's own colorsys module, which deals with colors in 0-1 rather than 0-255.
-            palette_norm = numpy.array(palette_base, numpy.single) * col_inverse_factor
-            palette_hsv = colorsys.rgb_to_hsv(palette_norm[0], palette_norm[1], palette_norm[2])
-
-            # A base palette with low saturation cannot change its saturation much. This preserves 'grey' base colors.
-            scaled_sat_variation = sat_variation * palette_hsv[1]
-            # Greyer tones should also have less value variation.
-            scaled_val_variation = val_variation * (palette_hsv[1] * 0.5 + 0.5)
-            
-            # Clamp the base sat and val variables such that any possible variation added to them will not take them over 1 or under 0.
-            clamped_sat = max(min(palette_hsv[1], 1 - scaled_sat_variation * 0.5), scaled_sat_variation * 0.5)
-            clamped_val = max(min(palette_hsv[2], 1 - scaled_val_variation * 0.5), scaled_val_variation * 0.5)
-
-            adjusted_hsv = [0, 0, 0]
-            # Adjust the hue with the hue_variation, and use modulo to wrap the output (allowing red values to straddle into crimson ones, for example).
-            adjusted_hsv[0] = ((random.uniform(0.0, hue_variation) + palette_hsv[0]) % 1)
-            # For saturation and value, get a random number within the range of the variations, and subtract half of that value to allow the values to move up or down.
-            adjusted_hsv[1] = clamped_sat + random.uniform(0.0, scaled_sat_variation) - scaled_sat_variation * 0.5
-            adjusted_hsv[2] = clamped_val + random.uniform(0.0, scaled_val_variation) - scaled_val_variation * 0.5
-
-            # Get the RGB again (which will be in a 0-1 format) then convert it back to 0-255.
-            generated_color_norm = colorsys.hsv_to_rgb(adjusted_hsv[0], adjusted_hsv[1], adjusted_hsv[2])
-            generated_color = [int(round(generated_color_norm[0] * 255)), int(round(generated_color_norm[1] * 255)), int(round(generated_color_norm[2] * 255))]
-
-        # Check if the generated color equals any of the key colors.
-        if not validate_color(generated_color):
-            continue
-
-        if tuple(generated_color) in used_cols:
-            continue
-        
-        # CHeck if the generated color equals any of the disallowed values.
-        is_disallowed = False
-        for d in range(len(disallowed_values)):
-            if generated_color == disallowed_values:
-                is_disallowed = True
-                continue
-
-        if is_disallowed:
-            continue
-
-        return generated_color
-
-    raise Exception("Error: After {} attempts, get_random_color failed to generate a color of the argued specifications and one that doesn't match any of the key colors.".format(current_attempt));
-    return None
+# A shuffled pool of every color within a palette base's hue, saturation and value variation envelope, sampled on a grid of palette_pool_steps per channel.
+# Colors are handed out in the pool's order, skipping any that have been used since the pool was made, so each color costs O(1) and none is ever given out twice.
+class ColorPool:
+    def __init__(self, palette_base, rng):
+        self.palette_base = tuple(int(c) for c in palette_base)
+        self.keys = rng.permutation(get_palette_keys(palette_base))
+        self.next_index = 0
+
+    # Take the next color in the pool that isn't in used_cols.
+    def take_color(self):
+        while self.next_index < len(self.keys):
+            key = int(self.keys[self.next_index])
+            self.next_index = self.next_index + 1
+            if key not in used_cols:
+                return unpack_color(key)
+
+        raise Exception("Error: Every one of the {} colors available to the palette based on '{}' is already in use. Increase hue_variation, sat_variation, val_variation or palette_pool_steps to allow"
+                        " more variants of this color, or give this state a different color.".format(len(self.keys), self.palette_base))
+
+# Get the packed keys of every color in a palette base's variation envelope, in ascending order. Each palette's colors are only worked out once, since every state that's filled
+# makes new pools of its own.
+def get_palette_keys(palette_base):
+    palette_key = pack_color(palette_base)
+    if palette_key not in palette_keys:
+        # skimage's color conversion is only needed to build a palette's colors, so it's only imported here.
+        from skimage.color import hsv2rgb
+
+        # If we want to deal with color generation in Hue-Sat-Value, we need to use python's own colorsys module, which deals with colors in 0-1 rather than 0-255.
+        palette_norm = numpy.array(palette_base, numpy.single) * col_inverse_factor
+        palette_hsv = colorsys.rgb_to_hsv(palette_norm[0], palette_norm[1], palette_norm[2])
+
+        # A base palette with low saturation cannot change its saturation much. This preserves 'grey' base colors.
+        scaled_sat_variation = sat_variation * palette_hsv[1]
+        # Greyer tones should also have less value variation.
+        scaled_val_variation = val_variation * (palette_hsv[1] * 0.5 + 0.5)
+
+        # Clamp the base sat and val variables such that any possible variation added to them will not take them over 1 or under 0.
+        clamped_sat = max(min(palette_hsv[1], 1 - scaled_sat_variation * 0.5), scaled_sat_variation * 0.5)
+        clamped_val = max(min(palette_hsv[2], 1 - scaled_val_variation * 0.5), scaled_val_variation * 0.5)
+
+        # The hue is only ever shifted upwards, and wraps around (allowing red values to straddle into crimson ones, for example). Saturation and value can move up or down.
+        steps = numpy.linspace(0.0, 1.0, palette_pool_steps)
+        hues = (palette_hsv[0] + steps * hue_variation) % 1
+        sats = clamped_sat + (steps - 0.5) * scaled_sat_variation
+        vals = clamped_val + (steps - 0.5) * scaled_val_variation
+        grid_hsv = numpy.stack(numpy.meshgrid(hues, sats, vals, indexing = "ij"), axis = -1).reshape(-1, 1, 3)
+        grid_colors = numpy.round(hsv2rgb(grid_hsv).reshape(-1, 3) * 255).astype(numpy.uint8)
+
+        # Many grid points round to the same color, and some may be key colors.
+        keys = numpy.unique(pack_colors(grid_colors))
+        palette_keys[palette_key] = keys[~numpy.isin(keys, [pack_color(ignore_col), pack_color(paint_over_col), pack_color(undetermined_col)])]
+    return palette_keys[palette_key]
+
+# Get a random color that doesn't equal any of the key colors used to operate on the image, or any color in used_cols.
+# If palette_base is specified, the random color will be a variant of this color, taken from that palette's color pool.
+def get_random_color(palette_base = None):
+    if palette_base is None:
+        for i in range(random_col_generation_attempts):
+            generated_color = unpack_color(int(color_rng.integers(packed_color_count)))
+            if validate_color(generated_color) and pack_color(generated_color) not in used_cols:
+                return generated_color
+
+        raise Exception("Error: After {} attempts, get_random_color failed to generate a color that isn't already used and doesn't match any of the key colors.".format(random_col_generation_attempts))
+
+    palette_key = pack_color(palette_base)
+    if palette_key not in color_pools:
+        # Each palette's pool is shuffled by its own seed, so a state's colors don't depend on the order that states are filled in, or on which process fills them.
+        color_pools[palette_key] = ColorPool(palette_base, numpy.random.default_rng([fill_seed, palette_key]))
+    return color_pools[palette_key].take_color()
 
 # Check to see if a color is one of the key colors reserved for operating on the image.
 def validate_color(color):
-    color = list(color)
+    color = tuple(int(c) for c in color)
     return not (color == ignore_col or
                 color == paint_over_col or
                 color == undetermined_col)
 
+# Records animation frames as the changes between them, rather than as copies of the whole image. Each frame is stored as the bounding box of the pixels that changed since the
+# previous frame, along with the new pixels in that box. Frames are rebuilt from the first one when played back, so only the current frame is ever held in full.
+# If a stream directory is argued, the changed pixels are written to that file as they're recorded rather than being held in memory, and are memory-mapped back when played.
+class AnimationRecorder:
+    def __init__(self, first_frame, stream_dir = None):
+        self.first_frame = first_frame.copy()
+        self.previous_frame = first_frame.copy()    # The last recorded frame, which the next one is compared with.
+        self.boxes = [] # The (y_min, x_min, y_max, x_max) box of each frame's changes, or None if the frame didn't change.
+        self.box_pixels = []    # The pixels in each frame's box, or (for a streamed recording) their offset into the stream file.
+        self.stream_dir = stream_dir
+        self.stream_file = open(stream_dir, "wb") if stream_dir else None
+        self.stream_data = None
+        self.playback_frame = None  # The frame most recently rebuilt for playback, and its index.
+        self.playback_index = -1
+
+    def __len__(self):
+        return len(self.boxes) + 1
+
+    # Record the argued image as the next frame. If a region (a tuple of slices) is argued, only that region is checked for changes.
+    def record(self, image, region = None):
+        if region is None:
+            region = (slice(0, image.shape[0]), slice(0, image.shape[1]))
+        y_offset, x_offset = region[0].start or 0, region[1].start or 0
+
+        changed_coords = numpy.nonzero((image[region] != self.previous_frame[region]).any(axis = 2))
+        if len(changed_coords[0]) == 0:
+            self.boxes.append(None)
+            self.box_pixels.append(None)
+            return
+
+        box = (y_offset + int(changed_coords[0].min()), x_offset + int(changed_coords[1].min()), y_offset + int(changed_coords[0].max()) + 1, x_offset + int(changed_coords[1].max()) + 1)
+        pixels = image[box[0]:box[2], box[1]:box[3]]
+        self.previous_frame[box[0]:box[2], box[1]:box[3]] = pixels
+
+        self.boxes.append(box)
+        if self.stream_file is not None:
+            self.box_pixels.append(self.stream_file.tell())
+            self.stream_file.write(numpy.ascontiguousarray(pixels).tobytes())
+        else:
+            self.box_pixels.append(pixels.copy())
+
+    # Get the frame of the argued index. Playing frames in order only applies one frame's changes at a time; going back to an earlier frame rebuilds it from the first.
+    def get_frame(self, index):
+        index = min(index, len(self) - 1)
+        if self.playback_frame is None or index < self.playback_index:
+            self.playback_frame = self.first_frame.copy()
+            self.playback_index = 0
+
+        if self.stream_file is not None and not self.stream_file.closed:
+            self.stream_file.close()
+            self.stream_data = numpy.memmap(self.stream_dir, dtype = numpy.uint8, mode = "r") if os.path.getsize(self.stream_dir) > 0 else None
+
+        for f in range(self.playback_index, index):
+            box = self.boxes[f]
+            if box is None:
+                continue
+            box_shape = (box[2] - box[0], box[3] - box[1], self.first_frame.shape[2])
+            if self.stream_dir:
+                pixels = self.stream_data[self.box_pixels[f]:self.box_pixels[f] + numpy.prod(box_shape)].reshape(box_shape)
+            else:
+                pixels = self.box_pixels[f]
+            self.playback_frame[box[0]:box[2], box[1]:box[3]] = pixels
+
+        self.playback_index = index
+        return self.playback_frame
+
 # Play an animation, looping through the recorded animation frames.
 def animate(frame):
-    global animation_frames
-    
-    latest_frame = min(frame, len(animation_frames) - 1)
-    
-    mat.set_data(animation_frames[latest_frame])
+    mat.set_data(animation_recorder.get_frame(frame))
     return mat
 
-# Copy the argued image into the animation frame for display later (will not record anything unless the 'animate' flag has been raised.
-def register_anim_frame(image):
-    if record_animation:
-        global animation_frames
-        animation_frames.append(image.copy())
+# Record the argued image as an animation frame for display later (will not record anything unless the 'animate' flag has been raised). If a region (a tuple of slices) is argued,
+# only that region of the image can have changed since the last frame.
+def register_anim_frame(image, region = None):
+    if animation_recorder is not None:
+        animation_recorder.record(image, region)
 
 ### Globals ###
 # Equal to 1 / 255. The number to multiply by when converting a normalised color value to a 255 color value.
 col_inverse_factor = 0.00392
 # 4 cardinal directions directions to find a coordinate's neighbours, defined clockwise starting from 'above'.
 directions = [[0, 1], [1, 1], [1, 0], [1, -1], [0, -1], [-1, -1], [-1, 0], [-1, 1]]
-# Stores the animation frames, which are iterated through after the process.
-animation_frames = []
-
-### Main Program ###
-province_guide = io.imread(province_outlines_dir)
-existing_map = None
-try:  
-    existing_map = io.imread(existing_provinces_dir)
-except FileNotFoundError:
-    print("\nNo existing map specified! The filling operation will not avoid any pre-existing province colour keys that are already on the map you're working on."
-          " If you have a map with existing provinces, add it to the workspace directory as an image named '{}'".format(existing_provinces_dir))
-    
-province_output = numpy.zeros(province_guide.shape, dtype = numpy.uint8)
-register_anim_frame(province_output)
-width = len(province_guide)
-height = len(province_guide[0])
-error_states_count = 0 # Debug counter to track if any states failed during the filling process.
-
+direction_weights = [2 if d % 2 == 0 else 1 for d in range(len(directions))]  # How much a neighbor in each direction counts towards a border pixel's color. Cardinal neighbors are worth more than diagonal ones.
+# Records the animation frames, which are iterated through after the process. Only created if record_animation is set.
+animation_recorder = None
 # Image-based debugging. Arrays used for printing shapes on the debug-output image to highlight any potential concerns with the map generation.
 undetermined_fragments = numpy.empty((0, 2), dtype = int)  # Positions of detected province fragments whose colour could not safely be determined automatically.
 stray_border_fragments = numpy.empty((0, 2), dtype = int)  # Positions of chunks of border pixels that had no internal white pixels (likely very small/narrow islands)
 
-used_cols = set()
-if existing_map is not None:
-    unique_cols_arr = numpy.unique(existing_map.reshape(-1, existing_map.shape[2]), axis = 0)
-    # Unique colours need to be made into tuples for their use in sets.
-    unique_in_existing = set(tuple(map(tuple, unique_cols_arr)))
-    # Black and white shouldn't be counted.
-    unique_in_existing.discard(ignore_col)
-    unique_in_existing.discard(paint_over_col)
-    print("\nDiscovered {} unique province key colours in {}.".format(len(unique_in_existing), existing_provinces_dir))
-    
-    used_cols.update(unique_in_existing)
-
-state_keys = set();
-
-unique_state_cols = set(tuple(map(tuple, numpy.unique(province_guide.reshape(-1, province_guide.shape[2]), axis = 0))))
-unique_state_cols.discard(ignore_col)
-unique_state_cols.discard(paint_over_col)
-print("\nDiscovered {} unique province key colours in {}.".format(len(unique_state_cols), province_outlines_dir))
-state_keys.update(unique_state_cols)
-
-print("\nAttempting to fill states ...")
+used_cols = set() # Packed keys of every color used on the map so far.
+fill_seed = numpy.random.SeedSequence(random_seed).entropy   # The seed that every random color is drawn from. Fresh each run, unless random_seed is set.
+color_rng = numpy.random.default_rng([fill_seed])   # Draws the colors that aren't variants of a palette.
+color_pools = {}    # The ColorPool of each palette base, keyed by the palette's packed color. Each state starts with no pools of its own.
+palette_keys = {}   # The packed keys of every color available to each palette base, keyed by the palette's packed color.
 
-undetermined_log = "Small province fragments (less than {} non-border pixels)".format(min_province_pixels)
-if undetermined_pixel_handling == 0:
-    print(undetermined_log + " with ambiguous province ownership will be colored {} and marked on the debug output.".format(undetermined_col))
-elif undetermined_pixel_handling == 1:
-    print(undetermined_log + " will be assigned to a neighboring province if that province is the only province in the same state touching them.")
-elif undetermined_pixel_handling == 2:
-    print(undetermined_log + " will be assigned to the neighboring province in the same state that they border the most.")
-else:
-    raise Exception("Error: undetermined_pixel_handling had an invalid value of {}.".format(undetermined_pixel_handling))
-for key in state_keys:
-    if not fill_state(province_guide, province_output, key):
-        error_states_count = error_states_count + 1
-
-# Add debug dots.
-if error_states_count > 0:
-    print("\nError: Not all states generated successfully, and the resulting image is not a reliable province map! "
-          + "The output will NOT be saved to FilledProvinces.png.\n\nStates successfully generated: {} / {}".format(len(state_keys) - error_states_count, len(state_keys)))
-else:
-    print("\nAll states generated successfully! Saving the output as {}! Use this output file, as it has the correct DPI.".format(filled_provinces_dir))
-    # I can only get the saved image to have the correct resolution, for some reason.
-    pyplot.imsave(filled_provinces_dir, province_output)
-
-if len(undetermined_fragments) > 0:
-    print("\nUndetermined Fragments found: {}\nThese are places where the continuous pixel count was below 'min_province_pixels' ({}), and thus were liable to be a disconnected chunk of another province.\n"
-          "Orange dots on the debug image.".format(len(undetermined_fragments), min_province_pixels))
-
-    for u in undetermined_fragments:
-        paste(province_output,  provutils.get_dot([255, 127, 0],  [255, 255, 255]), (u[0] - 1, u[1] - 1))
-
-# Register an animation-frame post debug dots.
-register_anim_frame(province_output)
+### Main Program ###
+if __name__ == "__main__":
+    parse_arguments("Fill the provinces of every state on the province guide with unique colors, variants of each state's color.")
+
+    # The guide is only ever compared by color, so it's held as a label image rather than as raw RGB.
+    province_guide = load_label_image(province_outlines_dir)
+    existing_map = None
+    try:  
+        existing_map = load_label_image(existing_provinces_dir)
+    except FileNotFoundError:
+        print("\nNo existing map specified! The filling operation will not avoid any pre-existing province colour keys that are already on the map you're working on."
+              " If you have a map with existing provinces, add it to the workspace directory as an image named '{}'".format(existing_provinces_dir))
+
+    if tile_rows > 0:
+        # The output is built straight into a temporary image file, so that it's never held in memory as a whole. It replaces the output file once every state is filled.
+        province_output = create_bmp(filled_provinces_dir + ".tmp", province_guide.shape)
+    else:
+        province_output = numpy.zeros(province_guide.shape + (3,), dtype = numpy.uint8)
+    if record_animation:
+        animation_recorder = AnimationRecorder(province_output, animation_stream_dir)
+    width = province_guide.shape[0]
+    height = province_guide.shape[1]
+    error_states_count = 0 # Debug counter to track if any states failed during the filling process.
+
+    if existing_map is not None:
+        unique_in_existing = set(existing_map.keys.tolist())
+        # Black and white shouldn't be counted.
+        unique_in_existing.discard(pack_color(ignore_col))
+        unique_in_existing.discard(pack_color(paint_over_col))
+        print("\nDiscovered {} unique province key colours in {}.".format(len(unique_in_existing), existing_provinces_dir))
+
+        used_cols.update(unique_in_existing)
+
+    state_keys = set();
+
+    unique_state_cols = set(province_guide.get_color(l) for l in range(len(province_guide)))
+    unique_state_cols.discard(ignore_col)
+    unique_state_cols.discard(paint_over_col)
+    print("\nDiscovered {} unique province key colours in {}.".format(len(unique_state_cols), province_outlines_dir))
+    state_keys.update(unique_state_cols)
+
+    print("\nAttempting to fill states ...")
+
+    undetermined_log = "Small province fragments (less than {} non-border pixels)".format(min_province_pixels)
+    if undetermined_pixel_handling == 0:
+        print(undetermined_log + " with ambiguous province ownership will be colored {} and marked on the debug output.".format(undetermined_col))
+    elif undetermined_pixel_handling == 1:
+        print(undetermined_log + " will be assigned to a neighboring province if that province is the only province in the same state touching them.")
+    elif undetermined_pixel_handling == 2:
+        print(undetermined_log + " will be assigned to the neighboring province in the same state that they border the most.")
+    else:
+        raise Exception("Error: undetermined_pixel_handling had an invalid value of {}.".format(undetermined_pixel_handling))
+    # Find the area of every state in one go, rather than searching the whole guide once per state.
+    state_areas = get_state_areas(province_guide, state_keys)
+    with timed_span("hash states"):
+        state_hashes = {k : get_state_area_hash(state_areas[k]) for k in state_keys}
+
+    # Only the states that have changed since the previous fill are filled again. The rest keep their previous colors.
+    previous_output, fill_record, unchanged_keys = find_unchanged_states(state_hashes, province_output.shape)
+    if len(unchanged_keys) > 0:
+        print("\n{} of {} states are unchanged since the previous fill, and will keep their province colors.".format(len(unchanged_keys), len(state_keys)))
+        keep_unchanged_states(previous_output, fill_record, unchanged_keys, state_areas, province_output)
+        register_anim_frame(province_output)
+    # The previous output may be memory-mapped from the output file, which must be closed before that file can be replaced.
+    previous_output = None
+    filled_keys = [k for k in state_keys if k not in set(unchanged_keys)]
+    error_states_count = fill_states(state_areas, filled_keys, province_output)
+
+    # Add debug dots.
+    if error_states_count > 0:
+        print("\nError: Not all states generated successfully, and the resulting image is not a reliable province map! "
+              + "The output will NOT be saved to FilledProvinces.png.\n\nStates successfully generated: {} / {}".format(len(state_keys) - error_states_count, len(state_keys)))
+    else:
+        print("\nAll states generated successfully! Saving the output as {}! Use this output file, as it has the correct DPI.".format(filled_provinces_dir))
+        with timed_span("write output"):
+            if tile_rows > 0:
+                # The memory-mapped output must be closed before it can be moved (on Windows). It's then mapped again copy-on-write, so that the debug dots below aren't saved.
+                province_output.flush()
+                del province_output
+                os.replace(filled_provinces_dir + ".tmp", filled_provinces_dir)
+                province_output = open_bmp(filled_provinces_dir, "c")
+            else:
+                save_image(filled_provinces_dir, province_output)
+            write_fill_record(state_hashes)
 
-if len(stray_border_fragments) > 0:
-    print("\nStray Border Fragments found: {}\n(These are border pixels that had no connected white pixels. They're probably islands that were too small to contain any white pixels.\n" 
-      "Blue dots on the debug image.".format(len(stray_border_fragments)))
+    if len(undetermined_fragments) > 0:
+        print("\nUndetermined Fragments found: {}\nThese are places where the continuous pixel count was below 'min_province_pixels' ({}), and thus were liable to be a disconnected chunk of another province.\n"
+              "Orange dots on the debug image.".format(len(undetermined_fragments), min_province_pixels))
 
-    for s in stray_border_fragments:
-        paste(province_output,  provutils.get_dot([0, 0, 255],  [255, 255, 255]), (s[0] - 1, s[1] - 1))
+        stamp_dots(province_output, undetermined_fragments, (255, 127, 0), (255, 255, 255))
 
-# Register an animation-frame post debug dots.
-register_anim_frame(province_output)
+    # Register an animation-frame post debug dots.
+    register_anim_frame(province_output)
 
-map_dpi = province_guide.shape[0] / 10
+    if len(stray_border_fragments) > 0:
+        print("\nStray Border Fragments found: {}\n(These are border pixels that had no connected white pixels. They're probably islands that were too small to contain any white pixels.\n" 
+          "Blue dots on the debug image.".format(len(stray_border_fragments)))
 
-anim_figure, axes = pyplot.subplots(figsize = (10, province_guide.shape[1] / map_dpi), dpi = map_dpi)
-mat = axes.matshow(province_output)
+        stamp_dots(province_output, stray_border_fragments, (0, 0, 255), (255, 255, 255))
 
-if record_animation:
-    anim = animation.FuncAnimation(anim_figure, animate, save_count=50, interval=5)
+    # Register an animation-frame post debug dots.
+    register_anim_frame(province_output)
 
-if open_in_fullscreen:
-    mng = pyplot.get_current_fig_manager()
-    mng.full_screen_toggle()
+    if not headless:
+        # matplotlib is only needed to display the output, so it's only imported here.
+        import matplotlib.pyplot as pyplot
+        from matplotlib import animation as animation
 
-pyplot.axis('off')
-pyplot.show()
+        map_dpi = province_guide.shape[0] / 10
 
+        anim_figure, axes = pyplot.subplots(figsize = (10, province_guide.shape[1] / map_dpi), dpi = map_dpi)
+        mat = axes.matshow(province_output)
 
+        if record_animation:
+            anim = animation.FuncAnimation(anim_figure, animate, save_count=50, interval=5)
 
+        if open_in_fullscreen:
+            mng = pyplot.get_current_fig_manager()
+            mng.full_screen_toggle()
 
-    
+        pyplot.axis('off')
+        pyplot.show()
@@ -4,11 +4,11 @@
 # Adjusts text and file names of all files found under the target directory to be within the appropriate format.
 # This is useful for quickly and correctly naming and ID-ing the default '1-Bavaria.txt' files that HoI creates when map editing, giving them sequential IDs and correctly formatted names.
 
-import sys
 import traceback
 import re
 from os import path, listdir, rename
 from provincialutils import *
+from provincialcli import parse_arguments
 from provincialsettings import *
 
 def get_lowest_id():
@@ -20,6 +20,7 @@ def get_lowest_id():
         incremented_id += 1
 
 ### Main Program ###
+parse_arguments("Give every file under the format target directory a sequential ID, and a name and contents in the appropriate format.")
 format_target_dir_context = format_target_dir
 file_dirs = []
 file_contents = []
@@ -39,10 +40,9 @@ try:
         file_count = len(file_dirs)
         print("Found {} files for formating under directory '{}'".format(file_count, format_target_dir_context))
 
+        # Each file is parsed once, edited in place, and only turned back into text when it's written.
         for file_dir in file_dirs:
-            file = open(format_target_dir_context + file_dir, "r")
-            file_contents.append(file.read())
-            file.close()
+            file_contents.append(read_script(format_target_dir_context + file_dir))
     else:
         print("'{}' directory not found, so the script cannot perform its reformat.".format(format_target_dir_context))
 
@@ -51,13 +51,13 @@ try:
         content = file_contents[i]
         file_dir = file_dirs[i]
         
-        content_id = int(get_field_content(content, format_id_target))
+        content_id = int(content.get_field_content(format_id_target))
         content_name = ""
         if format_name_target == "FILENAME":
             # Remove the '.txt'
             content_name = file_dir[0:-4]
         else:
-            content_name = get_field_content(content, format_name_target)
+            content_name = content.get_field_content(format_name_target)
         id_set.add(content_id)
         ids.append(content_id)
         names.append(content_name)
@@ -88,17 +88,15 @@ try:
         final_name = final_name.replace('@', content_name)
 
         # Hardcoded id and name targets. Needs to be fixed later.
-        content = set_field_content(content, "id", str(content_id))
-        content = set_field_content(content, "name", final_name)
+        content.set_field_content("id", str(content_id))
+        content.set_field_content("name", final_name)
 
         names[i] = final_name
         ids[i] = content_id
         file_contents[i] = content
 
     for i in range(len(file_dirs)):
-        file = open(format_target_dir_context + file_dirs[i], "w+")
-        file.write(file_contents[i])
-        file.close()
+        write_script(format_target_dir_context + file_dirs[i], file_contents[i])
 
         rename(format_target_dir_context + file_dirs[i], format_target_dir_context + names[i] + ".txt")
         
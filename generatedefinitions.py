@@ -6,249 +6,212 @@
 # Undefined provinces will be added to the end of the existing definition file.
 # Note that the existing definitions file MUST have a continuous sequence of IDs, with no gaps (i.e. no 1, 2, 3, 5). In this case, province number 4 will not be generated, and HoI 4 will probably crash.
 
-import sys
-import traceback
-import math
 import numpy as numpy
-import matplotlib.pyplot as pyplot
-from os import path, listdir
-from skimage import data, io
-from skimage.segmentation import flood, flood_fill
+from os import path
 from provincialutils import *
+from provincialcache import *
+from provincialcli import parse_arguments
+from provincialoverlay import paint_stripes
+from provincialprofiler import timed, timed_span, count
 from provincialsettings import *
 
-# Use the provided province inverse coordinates (basically the indices of all pixels of that province within the province map) to find the most common terrain type in that province.
-def get_terrain(terrain_map_flattened, province_inverse):
-    largest_count = 0
-    mode_terrain = None
-    terrain_totals = {}
-
-    province_terrain_pixels = terrain_map_flattened[province_inverse]
-    
-    t_cols, t_indices, t_inverses, t_counts = numpy.unique(province_terrain_pixels, axis = 0, return_index = True, return_inverse = True, return_counts = True)
-    
-    for t in range(len(t_cols)):
-        terrain_col = tuple(t_cols[t])
-
-        if not terrain_col in terrains:
-            raise Exception("Error: Terrain color '{}' has no entry in the 'terrains' dictionary in the settings file. Terrain type pixel count: {}".format(terrain_col, t_counts[t]))
-
-        current_terrain = terrains[terrain_col]
-        if not current_terrain in terrain_totals:
-            terrain_totals[current_terrain] = 0
-            
-        terrain_totals[current_terrain] += t_counts[t] * current_terrain.bias
-        if terrain_totals[current_terrain] > largest_count:
-            largest_count = terrain_totals[current_terrain]
-            mode_terrain = current_terrain
-
-    return mode_terrain
-
-# Get the index of all land provinces neighboring the argued sea province. Returns none if no land provinces neighbor this sea province.
-def get_coastal_neighbors(prov_inverses_unflattened, sea_prov_index, province_map, sea_province_set):
-    sea_prov_mask = prov_inverses_unflattened == sea_prov_index
-    x_min, y_min, x_max, y_max = find_bounds(sea_prov_mask)
-
-    # Increase the province view in all directions by 1 pixel, where not limited by the source province map's size.
-    y_min = max(0, y_min - 1)
-    x_min = max(0, x_min - 1)
-    y_max = min(province_map.shape[0] + 2, y_max + 2)
-    x_max = min(province_map.shape[1] + 2, x_max + 2)
-    
-     # Get a clamped view of both the inverse map and the province map to speed up search operations.
-    inverse_view_clamped = prov_inverses_unflattened[y_min:y_max, x_min:x_max]
-    province_view_clamped = province_map[y_min:y_max, x_min:x_max]
-
-    neighbor_prov_indices = set(inverse_view_clamped[get_outer_border(inverse_view_clamped, sea_prov_index)]) - sea_province_set
-
-    if len(neighbor_prov_indices) == 0:
-        return None
-    else:
-        return neighbor_prov_indices   
-
-# Get a mask where entries on the inverse map are true if they neighbor the argued target value (manhatten neighbors).
-def get_outer_border(inverse_map, target_province):
-    border_map = numpy.zeros(inverse_map.shape, dtype = bool)
-    
-    for y in range(inverse_map.shape[0]):
-        for x in range(inverse_map.shape[1]):
-            if inverse_map[y, x] != target_province:
-                border_map[y, x] = ((x > 0 and inverse_map[y, x - 1] == target_province) or
-                    (x < inverse_map.shape[1] - 1 and inverse_map[y, x + 1] == target_province) or
-                    (y > 0 and inverse_map[y - 1, x] == target_province) or
-                    (y < inverse_map.shape[0] - 1 and inverse_map[y + 1, x] == target_province))
-
-    return border_map
+# A lookup table from packed terrain colors to indices into the terrains of the 'terrains' dictionary in the settings file. Several colors may share the same terrain.
+# Terrains are indexed in the order of their lowest packed RGB key. Terrain maps are looked up one label at a time rather than one pixel at a time, since every pixel of a label shares its color.
+class TerrainLUT:
+    def __init__(self):
+        terrain_cols = sorted(terrains, key = pack_color)
+        self.keys = numpy.array([pack_color(c) for c in terrain_cols], dtype = numpy.uint32)
+        unique_terrains = list(dict.fromkeys(terrains[c] for c in terrain_cols))
+        self.key_terrains = numpy.array([unique_terrains.index(terrains[c]) for c in terrain_cols], dtype = numpy.int64) # The terrain index of each key.
+        self.terrains = numpy.array(unique_terrains, dtype = object)
+        self.biases = numpy.array([t.bias for t in unique_terrains], dtype = float)
+
+    def __len__(self):
+        return len(self.terrains)
+
+    # Get the terrain index of each of the argued packed keys, or -1 for keys with no entry in the 'terrains' dictionary.
+    def get_indices(self, keys):
+        indices = numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return numpy.where(self.keys[indices] == keys, self.key_terrains[indices], -1)
+
+    # Get the terrain index of every label of the argued terrain map (a LabelImage), or -1 for labels with no terrain.
+    def get_label_indices(self, terrain_map):
+        return self.get_indices(terrain_map.keys)
+
+# Find every color on the argued terrain map (a LabelImage) that has no entry in the 'terrains' dictionary, with its pixel count and the first few pixels it was found at (as [x, y]).
+# The map is only searched if there are unknown colors, in a single pass one band of rows at a time. Returns a list of (color, pixel count, sample coordinates) tuples.
+def find_unknown_terrain_colors(terrain_map, terrain_lut, sample_count = 3):
+    unknown_labels = numpy.flatnonzero(terrain_lut.get_label_indices(terrain_map) < 0)
+    if len(unknown_labels) == 0:
+        return []
+
+    is_unknown = numpy.zeros(len(terrain_map), dtype = bool)
+    is_unknown[unknown_labels] = True
+    pixel_counts = numpy.zeros(len(terrain_map), dtype = numpy.int64)
+    samples = {l : [] for l in unknown_labels}
+    for start, stop in get_row_bands(terrain_map.shape[0]):
+        band = terrain_map.labels[start:stop]
+        pixel_counts += numpy.bincount(band.ravel(), minlength = len(terrain_map))
+        unknown_coords = numpy.argwhere(is_unknown[band])
+        unknown_coord_labels = band[tuple(unknown_coords.T)]
+        for l in unknown_labels:
+            if len(samples[l]) < sample_count:
+                label_coords = unknown_coords[unknown_coord_labels == l][0:sample_count - len(samples[l])]
+                samples[l].extend([int(c[1]), int(c[0]) + start] for c in label_coords)
+
+    return [(terrain_map.get_color(l), int(pixel_counts[l]), samples[l]) for l in unknown_labels]
+
+# Check that every color on the argued terrain map (a LabelImage) has an entry in the 'terrains' dictionary. If any don't, every one of them is listed before an exception is raised,
+# so that they can all be fixed at once.
+def check_terrain_colors(terrain_map, terrain_lut):
+    unknown_colors = find_unknown_terrain_colors(terrain_map, terrain_lut)
+    if len(unknown_colors) == 0:
+        return
+
+    print("\nThe terrain map has {} colors with no entry in the 'terrains' dictionary in the settings file:".format(len(unknown_colors)))
+    for color, pixel_count, sample_coords in unknown_colors:
+        print("Terrain color '{}': {} pixels, including at (x, y) {}".format(color, pixel_count, ", ".join("({}, {})".format(x, y) for x, y in sample_coords)))
+    raise Exception("Error: {} terrain colors have no entry in the 'terrains' dictionary in the settings file (listed above). Add them to the dictionary, or paint them over on the terrain map."
+                    .format(len(unknown_colors)))
+
+# Get the continent number of every label of the argued continent map (a LabelImage), from the 'continents' dictionary in the settings file. Colors with no entry are given -1.
+def get_continent_values(continent_map):
+    return numpy.array([continents.get(continent_map.get_color(l), -1) for l in range(len(continent_map))], dtype = numpy.int64)
+
+# Find the dominant terrain, type, continent, coastal status and lake-coastal status of every province in the argued ProvinceIndex, using the argued terrain map and (optionally)
+# continent map, both LabelImages. Every province is given the default continent if there's no continent map. Returns arrays of each, indexed by province number.
+@timed()
+def find_province_definitions(province_index, terrain_map, continent_map = None):
+    province_count = len(province_index)
+    terrain_lut = TerrainLUT()
+    check_terrain_colors(terrain_map, terrain_lut)
+
+    # For each province, find its 'dominant' terrain (the terrain most common in that province, weighted by its bias) and the consequent type (if 'ocean', the type is sea, if 'lake' it's lake,
+    # otherwise it's land), and the continent most common in it. Every layer is aggregated in the same pass over the maps.
+    print("Finding dominant province terrains, types and continents ...")
+    layers = {"terrain" : AttributeLayer(terrain_map, terrain_lut.get_label_indices(terrain_map), len(terrain_lut), terrain_lut.biases)}
+    if continent_map is not None:
+        layers["continent"] = AttributeLayer(continent_map, get_continent_values(continent_map))
+    aggregates = aggregate_layers(province_index.labels, province_count, layers)
+
+    prov_terrains = terrain_lut.terrains[aggregates["terrain"].weighted_dominant]
+    terrain_names = numpy.array([t.name for t in prov_terrains], dtype = object)
+    prov_types = numpy.where(terrain_names == "ocean", "sea", numpy.where(terrain_names == "lake", "lake", "land")).astype(object)
+    prov_continents = numpy.full(province_count, default_continent, dtype = numpy.int64)
+    if continent_map is not None:
+        has_continent = aggregates["continent"].dominant >= 0
+        prov_continents[has_continent] = aggregates["continent"].dominant[has_continent]
+        if not has_continent.all():
+            print("{} provinces have no color from the 'continents' dictionary on the continent map, so they'll be given continent {}.".format(numpy.count_nonzero(~has_continent), default_continent))
+        count("provinces without a continent", int(numpy.count_nonzero(~has_continent)))
+    count("provinces defined", province_count)
+
+    # Any province touching a sea province (von-Neumann neighbors only) is coastal, as is the sea province itself (unless it only touches other sea provinces).
+    # Lake shores are found the same way, but are kept apart from the coast, since only the sea counts towards a province's coastal status in the definitions file.
+    # The province adjacency graph gives every neighboring pair at once from shifted comparisons of the labels, so only the pairs straddling a shore need to be checked.
+    print("Determing coastal provinces ...")
+    with timed_span("coastal detection"):
+        province_adjacency = AdjacencyGraph(province_index.labels, province_count)
+        prov_coastal = province_adjacency.get_edge_labels(prov_types == "sea")
+        prov_lake_coastal = province_adjacency.get_edge_labels(prov_types == "lake")
+    count("coastal provinces", int(numpy.count_nonzero(prov_coastal)))
+    count("lake coastal provinces", int(numpy.count_nonzero(prov_lake_coastal)))
+
+    return prov_terrains, prov_types, prov_continents, prov_coastal, prov_lake_coastal
+
+# Write the argued terrains, types, continents and coastal statuses of each province (indexed by province number) into the definitions table.
+@timed()
+def set_province_definitions(definitions, prov_cols, prov_terrains, prov_types, prov_continents, prov_coastal):
+    for p in range(len(prov_cols)):
+        # A province definition uses the format "ID ; R_Value ; G_Value ; B_Value ; Type ; Is_Coastal? ; Terrain ; Continent", followed by a new line.
+        definitions.set_definition(prov_cols[p], [prov_types[p], str(prov_coastal[p]).lower(), prov_terrains[p].name, str(prov_continents[p])])
 
 ### Main program ###
-province_map = io.imread(province_map_dir)  # The map defining provinces.
-terrain_map = io.imread(terrain_map_dir) # The map defining terrain. Slice away the alpha channel for indexed color images, I guess.
-province_definitions_dir_context = province_definitions_dir # The location of the province definition file, accounting for whether or not absolute path is enabled.
-terrain_debug = province_map.copy()
-type_debug = province_map.copy()
-
-# Using numpy.unique necessitates working on a 'flattened' (not actually flattened, but with only one traversable dimension, still allowing for RGB values) array.
-province_map_flattened = province_map.reshape(-1, province_map.shape[2])
-terrain_map_flattened = terrain_map.reshape(-1, terrain_map.shape[2])
-
-# If we're working with an absolute directory structure, rather than searching for files to read within this script's own directory, update the target directory accordingly.
-if mod_path_absolute:
-        my_path = path.abspath(path.dirname(__file__))
-        state_files_dir_context = path.join(my_path, state_files_dir)
-        province_definitions_dir_context = path.join(my_path, province_definitions_dir)
-
-print("Reading definitions file at '{}' to inform province IDs and respect existing data.".format(province_definitions_dir_context))
-definitions_file = open(province_definitions_dir_context, "r")
-definitions_text = definitions_file.read()
-definitions_file.close()
-
-# Find each unique color on the province map. Also get the 'inverse' of the map, which can be used to traverse a province's pixels more efficiently.
-print("Getting unique provinces ...")
-unique_prov_cols, prov_inverses = numpy.unique(province_map_flattened, return_inverse = True, axis = 0)
-number_of_provs = len(unique_prov_cols)
-prov_inverses_unflattened = prov_inverses.reshape([province_map.shape[0], province_map.shape[1]])
-
-print("Discovered {} provinces.".format(number_of_provs))
-highest_province_id = get_highest_province_id(definitions_text)
-print("The ID at the bottom line of the existing definitions file was '{}'. All newly assigned IDs will count up from this value.".format(highest_province_id))
-terrain_counts = {}
-type_counts = {}
-
-iterator = 0
-
-# Cache various data about each province's terrain, type, and coastal status. These arrays are indexed by province number.
-prov_terrains = numpy.empty(unique_prov_cols.shape[0], dtype = object)
-prov_types = numpy.empty(unique_prov_cols.shape[0], dtype = object)
-prov_coastal = numpy.zeros(unique_prov_cols.shape[0], dtype = bool)
-prov_coastal_count = 0
-sea_provs = set()
-
-# For each province, find its 'dominant' terrain (the terrain color most common in that province's bounds) and the consequent type (if 'ocean', the type is sea, if 'lake' it's lake, otherwise it's land).
-print("Finding dominant province terrains and types ...")
-for p in range(len(unique_prov_cols)):
-    iterator += 1
-    print(iterator)
-
-    prov_col = unique_prov_cols[p]
-    dominant_terrain = get_terrain(terrain_map_flattened, prov_inverses == p)
-    prov_terrains[p] = dominant_terrain
-    if not dominant_terrain in terrain_counts:
-        terrain_counts[dominant_terrain] = 0
-    terrain_counts[dominant_terrain] += 1
-
-    if dominant_terrain.name == "ocean":
-        type_string = "sea"
-        sea_provs.add(p)
-    elif dominant_terrain.name == "lake":
-        type_string = "lake"
-    else:
-        type_string = "land"
-
-    if not type_string in type_counts:
-        type_counts[type_string] = 0
-    prov_types[p] = type_string
-    type_counts[type_string] += 1
-
-# For each sea province, check all of its neighboring provinces. If any of them are land, then this sea province and its neighbor are both coastal.
-print("Determing coastal provinces ...")
-iterator = 0
-for s in sea_provs:
-    iterator += 1
-    print(iterator)
-    
-    neighboring_prov_indices = get_coastal_neighbors(prov_inverses_unflattened, s, province_map, sea_provs)
-    if neighboring_prov_indices != None:
-        prov_coastal[s] = True
-        prov_coastal_count += 1
-        for n in neighboring_prov_indices:
-            prov_coastal[n] = True
-
-        prov_coastal_count += len(neighboring_prov_indices)
-
-# Use the discovered data to write a new definitions file.
-print("Writing new definitions ...")
-for p in range(len(unique_prov_cols)):
-    prov_col = unique_prov_cols[p]
-
-    start_index, end_index = get_province_line(prov_col, definitions_text)
-    existing_definition = ""
-    new_definition = ""
-
-    if start_index == -1:
-        new_definition += str(highest_province_id + 1) + ";"
-        highest_province_id += 1
+if __name__ == "__main__":
+    parse_arguments("Generate the definition of every province on the province map (its type, terrain and coastal status), and write a new definitions file.")
+
+    province_labels = load_label_image(province_map_dir)  # The labels of the map defining provinces.
+    terrain_labels = load_label_image(terrain_map_dir) # The labels of the map defining terrain.
+    continent_labels = None # The labels of the map defining continents, if there is one.
+    if path.exists(continent_map_dir):
+        continent_labels = load_label_image(continent_map_dir)
     else:
-        existing_definition = definitions_text[start_index:end_index]
-        id_semicolon = existing_definition.find(";")
-        new_definition += existing_definition[0:id_semicolon] + ";"
-
-    # A province definition uses the format "R_Value ; G_Value ; B_Value ; Type ; Is_Coastal? ; Terrain ; Continent", followed by a new line.
-    new_definition += str(prov_col[0]) + ";" + str(prov_col[1]) + ";" + str(prov_col[2]) + ";" + prov_types[p] + ";" + str(prov_coastal[p]).lower() +  ";" + prov_terrains[p].name + ";" + "1"
-
-    if start_index == -1:
-        required_new_line = "\n" if len(definitions_text) > 0 and definitions_text[len(definitions_text) - 1] != "\n" else ""
-        definitions_text += required_new_line + new_definition
+        print("No continent map was found at '{}', so every province will be given continent {}.".format(continent_map_dir, default_continent))
+    province_definitions_dir_context = province_definitions_dir # The location of the province definition file, accounting for whether or not absolute path is enabled.
+
+    # If we're working with an absolute directory structure, rather than searching for files to read within this script's own directory, update the target directory accordingly.
+    if mod_path_absolute:
+            my_path = path.abspath(path.dirname(__file__))
+            state_files_dir_context = path.join(my_path, state_files_dir)
+            province_definitions_dir_context = path.join(my_path, province_definitions_dir)
+
+    print("Reading definitions file at '{}' to inform province IDs and respect existing data.".format(province_definitions_dir_context))
+    definitions = read_definitions(province_definitions_dir_context)
+
+    # Find each unique color on the province map. Also get the 'inverse' of the map (its labels), which can be used to traverse a province's pixels more efficiently.
+    print("Getting unique provinces ...")
+    unique_prov_cols = province_labels.colors
+    prov_inverses_unflattened = province_labels.labels
+    number_of_provs = len(unique_prov_cols)
+    # The bounds of each province, so that only the pixels around a province need to be searched when finding its terrain and neighbors.
+    province_index = load_province_index(province_labels)
+
+    print("Discovered {} provinces.".format(number_of_provs))
+    highest_province_id = definitions.get_highest_id()
+    print("The ID at the bottom line of the existing definitions file was '{}'. All newly assigned IDs will count up from this value.".format(highest_province_id))
+
+    # For each province, find its 'dominant' terrain and its type, and whether or not it's coastal.
+    prov_terrains, prov_types, prov_continents, prov_coastal, prov_lake_coastal = find_province_definitions(province_index, terrain_labels, continent_labels)
+    prov_coastal_count = numpy.count_nonzero(prov_coastal)
+
+    terrain_counts = {}
+    type_counts = {}
+    for p in range(number_of_provs):
+        terrain_counts[prov_terrains[p]] = terrain_counts.get(prov_terrains[p], 0) + 1
+        type_counts[prov_types[p]] = type_counts.get(prov_types[p], 0) + 1
+
+    # Use the discovered data to write a new definitions file. Existing definitions keep their ID and are rewritten in place, new ones are added to the end.
+    print("Writing new definitions ...")
+    set_province_definitions(definitions, unique_prov_cols, prov_terrains, prov_types, prov_continents, prov_coastal)
+
+    # Print some sanity-check logs to help the user be sure that everything is working okay (or indicate if something went wrong).
+    terrain_count_text = "Of {} provinces, the following percentages were of a given terrain:\n".format(number_of_provs)
+    for terrain in terrain_counts:
+        terrain_count_text += terrain.name + ": " + str(terrain_counts[terrain] / number_of_provs * 100) + "%, "
+
+    type_count_text = "Of {} provinces, the following percentages were of a given type:\n".format(number_of_provs)
+    for type_str in type_counts:
+        type_count_text += type_str + ": " + str(type_counts[type_str] / number_of_provs * 100) + "%, "
+
+    coastal_count_text = "Of {} provinces, the following percentages were coastal:\n{}".format(number_of_provs, str(prov_coastal_count / number_of_provs * 100) + "%")
+
+    print(terrain_count_text)
+    print(type_count_text)
+    print(coastal_count_text)
+    if "lake" in type_counts:
+        print("Of {} provinces, the following percentages were on the shore of a lake:\n{}".format(number_of_provs, str(numpy.count_nonzero(prov_lake_coastal) / number_of_provs * 100) + "%"))
+
+    # If specified, automatically write the result to the existing definitions directory.
+    if edit_existing_definitions:
+        print("Writing new definitions text to '{}'".format(definitions_output_dir))
+        definitions.write(definitions_output_dir)
     else:
-        definitions_text = definitions_text[0:start_index] + new_definition + definitions_text[end_index:len(definitions_text)]
-
-# Print some sanity-check logs to help the user be sure that everything is working okay (or indicate if something went wrong).
-terrain_count_text = "Of {} provinces, the following percentages were of a given terrain:\n".format(number_of_provs)
-for terrain in terrain_counts:
-    terrain_count_text += terrain.name + ": " + str(terrain_counts[terrain] / number_of_provs * 100) + "%, "
-
-type_count_text = "Of {} provinces, the following percentages were of a given type:\n".format(number_of_provs)
-for type_str in type_counts:
-    type_count_text += type_str + ": " + str(type_counts[type_str] / number_of_provs * 100) + "%, "
-
-coastal_count_text = "Of {} provinces, the following percentages were coastal:\n{}".format(number_of_provs, str(prov_coastal_count / number_of_provs * 100) + "%")
-
-print(terrain_count_text)
-print(type_count_text)
-print(coastal_count_text)
-
-# If specified, automatically write the result to the existing definitions directory.
-if edit_existing_definitions:
-    new_definitions_file = open(definitions_output_dir, "w+")
-    print("Writing new definitions text to '{}'".format(definitions_output_dir))
-    new_definitions_file.write(definitions_text)
-else:
-    print("Will not write new definitions to existing directory '{}', set the 'edit_existing_definitions' flag in the provincial settings file to change this.").format(definitions_output_dir)
-
-# Create a debug map to help show recognised terrain types.
-for y in range(terrain_debug.shape[0]):
-    for x in range(terrain_debug.shape[1]):
-        period = (x + y) % 5
-        if period >= 3 and period < 5:
-            province_index = prov_inverses_unflattened[y, x]
-            terrain_debug[y, x] = prov_terrains[province_index].display_col
-
-map_dpi = terrain_debug.shape[0] / 10
-pyplot.figure(figsize = (10, province_map.shape[1] / map_dpi), dpi = map_dpi)
-pyplot.imshow(terrain_debug)
-pyplot.axis('off')
-pyplot.show()
-
-# Create a second debug map to help show recognised coastal statuses.
-for y in range(type_debug.shape[0]):
-    for x in range(type_debug.shape[1]):
-        period = (x + y) % 5
-        if period >= 3 and period < 5:
-            province_index = prov_inverses_unflattened[y, x]
-            stripe_col = None
-            if prov_coastal[province_index]:
-                stripe_col = (255, 255, 0)
-            else:
-                prov_type = prov_types[province_index]
-                stripe_col = (255, 0, 0) if prov_type == "sea" else ((0, 64, 127) if prov_type == "land" else (255, 127, 0))
-                
-            type_debug[y, x] = stripe_col
-
-map_dpi = type_debug.shape[0] / 10
-pyplot.figure(figsize = (10, province_map.shape[1] / map_dpi), dpi = map_dpi)
-pyplot.imshow(type_debug)
-pyplot.axis('off')
-pyplot.show()
-
-        
-        
-    
+        print("Will not write new definitions to existing directory '{}', set the 'edit_existing_definitions' flag in the provincial settings file to change this.".format(definitions_output_dir))
+
+    # The debug maps are only built if they'll be shown.
+    if not headless:
+        terrain_debug = province_labels.get_image()
+        type_debug = terrain_debug.copy()
+
+        # Create a debug map to help show recognised terrain types, striped in the display color of each province's terrain.
+        paint_stripes(terrain_debug, prov_inverses_unflattened, [t.display_col for t in prov_terrains])
+        show_image(terrain_debug)
+
+        # Create a second debug map to help show recognised coastal statuses. Coastal provinces are striped yellow, and the rest by their type.
+        type_palette = numpy.empty((number_of_provs, 3), dtype = numpy.uint8)
+        type_palette[:] = (255, 127, 0)
+        type_palette[prov_types == "sea"] = (255, 0, 0)
+        type_palette[prov_types == "land"] = (0, 64, 127)
+        type_palette[prov_coastal] = (255, 255, 0)
+        paint_stripes(type_debug, prov_inverses_unflattened, type_palette)
+        show_image(type_debug)
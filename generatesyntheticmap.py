@@ -0,0 +1,206 @@
+# Provincial: Province handling tool for Hearts of Iron IV
+# Thomas Slade, 2020
+
+# Generates a synthetic map and a matching set of mod files, for testing and benchmarking Provincial without needing a real mod.
+# Provinces are Voronoi cells scattered across the map, some of which are made sea. Land provinces are grouped into states, and terrain is painted in its own, coarser cells.
+# The following are written to the synthetic output directory:
+# - ProvinceOutlines.bmp: a province guide in the form fillprovinces.py expects, with state-colored borders around white provinces and black sea.
+# - FilledProvinces.bmp: the provinces themselves, each in a unique color.
+# - Terrain.bmp: a terrain map, using the RGB keys in the 'terrains' dictionary of the settings file.
+# - map/definition.csv and history/states/: a definitions file and one state file per state, matching the provinces and states above.
+
+import os
+import numpy as numpy
+from skimage import io
+from scipy import ndimage
+from scipy.spatial import cKDTree
+from provincialutils import *
+from provincialcli import parse_arguments
+from provincialsettings import *
+
+# The number of map rows whose nearest Voronoi seeds are found at a time, which keeps memory use flat on very large maps.
+voronoi_chunk_rows = 256
+
+# A synthetic map and the mod data describing it. Provinces and states are referred to by their index, which is also their position in the color arrays.
+class SyntheticMap:
+    def __init__(self, province_labels, province_colors, is_sea, state_of_province, state_colors, province_terrains, terrain_image):
+        self.province_labels = province_labels  # The index of the province at each pixel.
+        self.province_colors = province_colors  # The unique RGB color of each province.
+        self.is_sea = is_sea    # Whether or not each province is a sea province.
+        self.state_of_province = state_of_province  # The index of the state each province belongs to, or -1 for sea provinces.
+        self.state_colors = state_colors    # The unique RGB color of each state.
+        self.province_terrains = province_terrains  # The TerrainData that covers most of each province.
+        self.terrain_image = terrain_image
+
+    # The filled province map, with every province in its own color.
+    def get_province_image(self):
+        return self.province_colors[self.province_labels]
+
+    # The province guide: land provinces are white, surrounded by borders in the color of their state, and sea is black.
+    # Borders are drawn on one side of the line between two provinces of the same state, and on both sides of the line between two states, so that every state is enclosed by its own color.
+    def get_outline_image(self):
+        labels = self.province_labels
+        pixel_states = numpy.where(self.is_sea, -1, self.state_of_province)[labels]
+        is_land = pixel_states >= 0
+
+        # Land pixels on the edge of the map always form part of their state's border.
+        border_mask = numpy.zeros(labels.shape, dtype = bool)
+        border_mask[[0, -1], :] = True
+        border_mask[:, [0, -1]] = True
+
+        border_mask[:, :-1] |= labels[:, :-1] != labels[:, 1:]
+        border_mask[:-1, :] |= labels[:-1, :] != labels[1:, :]
+        border_mask[:, 1:] |= pixel_states[:, 1:] != pixel_states[:, :-1]
+        border_mask[1:, :] |= pixel_states[1:, :] != pixel_states[:-1, :]
+        border_mask &= is_land
+
+        outline_image = numpy.empty(labels.shape + (3,), dtype = numpy.uint8)
+        outline_image[:] = ignore_col
+        outline_image[is_land] = paint_over_col
+        outline_image[border_mask] = self.state_colors[pixel_states[border_mask]]
+        return outline_image
+
+    # The province guide, with up to the argued number of province fragments drawn onto it: areas of up to 2x2 pixels (and always smaller than min_province_pixels), enclosed by a border in the color of their state.
+    # Each fragment is placed wholly within the land of a single state, and fragments may touch or overlap each other. Fragments are placed the same way for the same seed.
+    def get_fragmented_outline_image(self, fragment_count, seed = 0):
+        rng = numpy.random.default_rng(seed)
+        outline_image = self.get_outline_image()
+        pixel_states = numpy.where(self.is_sea, -1, self.state_of_province)[self.province_labels]
+        height, width = pixel_states.shape
+
+        placed_count = 0
+        for attempt in range(fragment_count * 20):
+            y, x = rng.integers(1, height - 3), rng.integers(1, width - 3)
+            fragment_height, fragment_width = rng.integers(1, 3, 2)
+            block_slices = (slice(y - 1, y + fragment_height + 1), slice(x - 1, x + fragment_width + 1))
+            block_states = pixel_states[block_slices]
+            if block_states[0, 0] < 0 or (block_states != block_states[0, 0]).any() or fragment_height * fragment_width >= min_province_pixels:
+                continue
+
+            outline_image[block_slices] = self.state_colors[block_states[0, 0]]
+            outline_image[y:y + fragment_height, x:x + fragment_width] = paint_over_col
+            placed_count += 1
+            if placed_count == fragment_count:
+                break
+
+        return outline_image
+
+    # The text of a definitions file defining every province, with IDs counting up from 1 in province order.
+    def get_definitions_text(self):
+        coastal = AdjacencyGraph(self.province_labels, len(self.province_colors)).get_edge_labels(self.is_sea)
+
+        lines = ["0;0;0;0;land;false;unknown;0"]
+        for p in range(len(self.province_colors)):
+            color = self.province_colors[p]
+            province_type = "sea" if self.is_sea[p] else "land"
+            lines.append("{};{};{};{};{};{};{};1".format(p + 1, color[0], color[1], color[2], province_type, str(coastal[p]).lower(), self.province_terrains[p].name))
+        return "\n".join(lines) + "\n"
+
+    # Get the contents of a state file for every state, keyed by file name. The template text is used as the base of every file.
+    def get_state_scripts(self, template_text):
+        state_scripts = {}
+        province_ids = numpy.arange(1, len(self.province_colors) + 1)
+        for s in range(len(self.state_colors)):
+            state_col = tuple(int(c) for c in self.state_colors[s])
+            script = ScriptDocument(color_comment_prefix + " " + list_to_string(state_col) + "\n" + template_text)
+            script.set_field_content("id", str(s + 1))
+            script.set_field_content("name", "\"STATE_{}\"".format(s + 1))
+            script.set_field_content("provinces", list_to_string(province_ids[self.state_of_province == s].tolist()), True)
+            state_scripts["{}-STATE_{}.txt".format(s + 1, s + 1)] = script.get_text()
+        return state_scripts
+
+# Get the index of the nearest seed point to every pixel of a map of the argued shape. Seed points are given as [y, x].
+def get_voronoi_labels(shape, seed_points):
+    seed_tree = cKDTree(seed_points)
+    labels = numpy.empty(shape, dtype = numpy.int32)
+    columns = numpy.arange(shape[1])
+
+    for row_start in range(0, shape[0], voronoi_chunk_rows):
+        rows = numpy.arange(row_start, min(row_start + voronoi_chunk_rows, shape[0]))
+        pixel_coords = numpy.stack(numpy.meshgrid(rows, columns, indexing = "ij"), axis = -1).reshape(-1, 2)
+        nearest_seeds = seed_tree.query(pixel_coords, workers = -1)[1]
+        labels[rows[0]:rows[-1] + 1] = nearest_seeds.reshape(len(rows), shape[1])
+
+    return labels
+
+# Get the argued number of distinct random colors, none of which are key colors or among the argued excluded packed keys.
+def get_unique_random_colors(count, rng, excluded_keys = ()):
+    excluded_keys = set(excluded_keys) | {pack_color(ignore_col), pack_color(paint_over_col), pack_color(undetermined_col)}
+    keys = rng.choice(packed_color_count, count + len(excluded_keys), replace = False)
+    keys = keys[~numpy.isin(keys, list(excluded_keys))][0:count]
+    return unpack_colors(keys)
+
+# Generate a synthetic map of the argued size, with roughly the argued number of pixels per province and provinces per state, and roughly the argued fraction of sea provinces.
+def generate_synthetic_map(width, height, pixels_per_province, provinces_per_state, sea_fraction, seed = 0):
+    rng = numpy.random.default_rng(seed)
+    shape = (height, width)
+
+    province_count = max(2, (width * height) // pixels_per_province)
+    province_seeds = rng.random((province_count, 2)) * shape
+    province_labels = get_voronoi_labels(shape, province_seeds)
+    province_colors = get_unique_random_colors(province_count, rng)
+
+    # Sea is wherever a smooth noise field (sampled at each province's seed) falls below the sea fraction, which gives a few large oceans rather than scattered sea provinces.
+    noise = rng.random((6, 12))
+    noise_coords = province_seeds.T / numpy.array(shape)[:, None] * (numpy.array(noise.shape)[:, None] - 1)
+    province_noise = ndimage.map_coordinates(noise, noise_coords, order = 3, mode = "nearest")
+    is_sea = province_noise < numpy.quantile(province_noise, sea_fraction)
+    land_provinces = numpy.flatnonzero(~is_sea)
+
+    # Each land province belongs to the state whose seed (one of the land provinces) is nearest to it.
+    state_count = max(1, len(land_provinces) // provinces_per_state)
+    state_seeds = province_seeds[rng.choice(land_provinces, state_count, replace = False)]
+    state_of_province = numpy.full(province_count, -1, dtype = numpy.int64)
+    state_of_province[land_provinces] = cKDTree(state_seeds).query(province_seeds[land_provinces])[1]
+    state_colors = get_unique_random_colors(state_count, rng, pack_colors(province_colors).tolist())
+
+    # Terrain is painted in Voronoi cells of its own, four times coarser than the map, so that provinces often straddle several terrains. Sea is always ocean.
+    land_terrains = [terrains[t] for t in terrains if terrains[t].name != "ocean"]
+    land_terrain_colors = numpy.array([t.display_col for t in land_terrains], dtype = numpy.uint8)
+    terrain_shape = ((height + 3) // 4, (width + 3) // 4)
+    terrain_cell_count = max(1, province_count // 4)
+    terrain_cells = get_voronoi_labels(terrain_shape, rng.random((terrain_cell_count, 2)) * terrain_shape)
+    cell_terrains = rng.integers(0, len(land_terrains), terrain_cell_count)
+    terrain_indices = numpy.repeat(numpy.repeat(cell_terrains[terrain_cells], 4, axis = 0), 4, axis = 1)[0:height, 0:width]
+    terrain_image = land_terrain_colors[terrain_indices]
+    terrain_image[is_sea[province_labels]] = terrain_ocean.display_col
+
+    # The terrain covering most of each province, for the definitions file.
+    terrain_votes = numpy.bincount(province_labels.ravel() * len(land_terrains) + terrain_indices.ravel(), minlength = province_count * len(land_terrains))
+    dominant_terrains = numpy.argmax(terrain_votes.reshape(province_count, len(land_terrains)), axis = 1)
+    province_terrains = numpy.array([terrain_ocean if is_sea[p] else land_terrains[dominant_terrains[p]] for p in range(province_count)], dtype = object)
+
+    return SyntheticMap(province_labels, province_colors, is_sea, state_of_province, state_colors, province_terrains, terrain_image)
+
+# Write the images and mod files of the argued synthetic map into the argued directory.
+def write_synthetic_map(synthetic_map, output_dir, template_dir = "StateFileTemplate.txt"):
+    states_dir = os.path.join(output_dir, "history", "states")
+    os.makedirs(states_dir, exist_ok = True)
+    os.makedirs(os.path.join(output_dir, "map"), exist_ok = True)
+
+    io.imsave(os.path.join(output_dir, "ProvinceOutlines.bmp"), synthetic_map.get_outline_image(), check_contrast = False)
+    io.imsave(os.path.join(output_dir, "FilledProvinces.bmp"), synthetic_map.get_province_image(), check_contrast = False)
+    io.imsave(os.path.join(output_dir, "Terrain.bmp"), synthetic_map.terrain_image, check_contrast = False)
+
+    with open(os.path.join(output_dir, "map", "definition.csv"), "w+") as definitions_file:
+        definitions_file.write(synthetic_map.get_definitions_text())
+
+    with open(template_dir, "r") as template_file:
+        template_text = template_file.read()
+    state_scripts = synthetic_map.get_state_scripts(template_text)
+    for file_name in state_scripts:
+        with open(os.path.join(states_dir, file_name), "w+") as state_file:
+            state_file.write(state_scripts[file_name])
+
+### Main Program ###
+if __name__ == "__main__":
+    parse_arguments("Generate a synthetic map and a matching set of mod files, for testing and benchmarking.")
+
+    width, height = synthetic_map_size
+    print("Generating a {}x{} synthetic map with roughly {} pixels per province ...".format(width, height, synthetic_pixels_per_province))
+    synthetic_map = generate_synthetic_map(width, height, synthetic_pixels_per_province, synthetic_provinces_per_state, synthetic_sea_fraction, synthetic_map_seed)
+
+    print("Generated {} provinces ({} sea) in {} states. Writing the map and its mod files to '{}' ...".format(len(synthetic_map.province_colors), numpy.count_nonzero(synthetic_map.is_sea),
+                                                                                                   len(synthetic_map.state_colors), synthetic_output_dir))
+    write_synthetic_map(synthetic_map, synthetic_output_dir)
+    print("Done.")
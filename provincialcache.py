@@ -0,0 +1,129 @@
+# Provincial: Province handling tool for Hearts of Iron IV
+# Thomas Slade, 2020
+
+# A persistent cache of decoded maps, so that running several scripts over the same unchanged map doesn't decode and label it from scratch every time.
+# Each map's cache entry is a directory named after a hash of the map file's content, holding .npy files that are memory-mapped when loaded.
+# Editing a map changes its hash, so stale entries are never read: they're simply left unused until they're evicted to keep the cache under its size limit.
+
+import hashlib
+import os
+import shutil
+import numpy as numpy
+from skimage import io
+from provincialutils import LabelImage, ProvinceIndex, open_bmp
+from provincialprofiler import timed, count
+from provincialsettings import *
+
+# Part of every entry's hash. Change this whenever the layout of cached data changes, so that entries written by an older version are ignored.
+cache_format_version = "1"
+
+# Get a hash of the content of the argued file, which identifies its cache entry.
+def get_file_hash(file_dir):
+    file_hash = hashlib.sha1(cache_format_version.encode())
+    with open(file_dir, "rb") as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+# Load the arrays of the argued names from a cache entry, memory-mapped. Returns None if the entry doesn't hold all of them.
+def read_cache_arrays(entry_dir, names):
+    arrays = {}
+    try:
+        for name in names:
+            arrays[name] = numpy.load(os.path.join(entry_dir, name + ".npy"), mmap_mode = "r")
+    except (OSError, ValueError):
+        return None
+
+    # Mark the entry as recently used, so it's the last to be evicted.
+    os.utime(entry_dir)
+    return arrays
+
+# Save the argued arrays (keyed by name) into a cache entry, then evict old entries if the cache has grown too large.
+@timed()
+def write_cache_arrays(entry_dir, arrays):
+    os.makedirs(entry_dir, exist_ok = True)
+    for name in arrays:
+        # Write to a temporary file first, so that an interrupted run never leaves a partial array behind.
+        temporary_dir = os.path.join(entry_dir, name + ".tmp.npy")
+        numpy.save(temporary_dir, numpy.ascontiguousarray(arrays[name]))
+        os.replace(temporary_dir, os.path.join(entry_dir, name + ".npy"))
+
+    evict_cache_entries(entry_dir)
+
+# Delete the least recently used cache entries until the cache is no larger than cache_max_bytes. The argued entry is never deleted.
+def evict_cache_entries(kept_entry_dir = None):
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    total_size = 0
+    for entry_name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, entry_name)
+        if not os.path.isdir(entry_dir):
+            continue
+        entry_size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+        entries.append((os.path.getmtime(entry_dir), entry_size, entry_dir))
+        total_size += entry_size
+
+    entries.sort()
+    for last_used, entry_size, entry_dir in entries:
+        if total_size <= cache_max_bytes:
+            break
+        if kept_entry_dir is not None and os.path.samefile(entry_dir, kept_entry_dir):
+            continue
+        shutil.rmtree(entry_dir, ignore_errors = True)
+        total_size -= entry_size
+
+# Read the image at the argued directory. When processing in tiles, a BMP is memory-mapped rather than read into memory.
+def read_map_image(image_dir):
+    if tile_rows > 0:
+        image = open_bmp(image_dir)
+        if image is not None:
+            return image
+    return io.imread(image_dir)
+
+# Load the map at the argued directory as a LabelImage, from the cache if the map hasn't changed since it was last cached.
+@timed()
+def load_label_image(image_dir):
+    if not use_map_cache:
+        return LabelImage(read_map_image(image_dir))
+
+    entry_dir = os.path.join(cache_dir, get_file_hash(image_dir))
+    arrays = read_cache_arrays(entry_dir, ["labels", "keys"])
+    if arrays is not None:
+        count("cache hits")
+        label_image = LabelImage(arrays["labels"], arrays["keys"])
+    elif tile_rows > 0:
+        # The labels are written straight into their memory-mapped cache file, so that they're never held in memory as a whole.
+        image = read_map_image(image_dir)
+        os.makedirs(entry_dir, exist_ok = True)
+        temporary_dir = os.path.join(entry_dir, "labels.tmp.npy")
+        labels = numpy.lib.format.open_memmap(temporary_dir, mode = "w+", dtype = numpy.int32, shape = image.shape[0:2])
+        label_image = LabelImage(image, labels_out = labels)
+        labels.flush()
+        del labels, label_image.labels
+        os.replace(temporary_dir, os.path.join(entry_dir, "labels.npy"))
+        write_cache_arrays(entry_dir, {"keys" : label_image.keys})
+        label_image.labels = numpy.load(os.path.join(entry_dir, "labels.npy"), mmap_mode = "r")
+    else:
+        label_image = LabelImage(io.imread(image_dir))
+        write_cache_arrays(entry_dir, {"labels" : label_image.labels, "keys" : label_image.keys})
+
+    label_image.cache_entry = entry_dir
+    return label_image
+
+# Get the ProvinceIndex of the argued label image, from the cache if the label image was loaded with load_label_image and its statistics have been cached before.
+@timed()
+def load_province_index(label_image):
+    entry_dir = label_image.cache_entry
+    if entry_dir is None:
+        return ProvinceIndex(label_image)
+
+    columns = read_cache_arrays(entry_dir, ProvinceIndex.column_names)
+    if columns is not None:
+        count("cache hits")
+        return ProvinceIndex(label_image, columns)
+
+    province_index = ProvinceIndex(label_image)
+    write_cache_arrays(entry_dir, province_index.get_columns())
+    return province_index
@@ -0,0 +1,103 @@
+# Provincial: Province handling tool for Hearts of Iron IV
+# Thomas Slade, 2020
+
+# The command line shared by every script. Any directory in provincialsettings.py can be overridden for a single run (for example '--inputs-dir Maps/'), and the directories that
+# the settings file builds from an overridden one follow it (so '--outputs-dir Out/' also moves the cache and every output image).
+# '--headless' runs a script without opening any windows, and without ever importing matplotlib, for use in batch runs. '--no-progress' turns off progress reports.
+# '--report' writes a report of how long each stage of the run took, and '--profile' also profiles the whole run with cProfile (see provincialprofiler.py).
+
+import argparse
+import ast
+import atexit
+import cProfile
+import os
+import sys
+import provincialsettings
+import provincialprofiler
+
+# Get the names of the settings that can be overridden from the command line.
+def get_overridable_settings():
+    return [name for name in vars(provincialsettings) if name.endswith("_dir") and isinstance(getattr(provincialsettings, name), str)]
+
+# Get an argument parser holding the arguments shared by every script, which a script may add its own arguments to.
+def get_argument_parser(description):
+    parser = argparse.ArgumentParser(description = description)
+    parser.add_argument("--headless", action = "store_true", help = "Don't open any windows or import matplotlib. Output files are still written.")
+    parser.add_argument("--no-progress", dest = "show_progress", action = "store_false", help = "Don't report the progress of long loops.")
+    parser.add_argument("--report", action = "store_true", help = "Record the time (and peak memory) of each stage of the run, and write them to the stage report.")
+    parser.add_argument("--profile", action = "store_true", help = "Profile the whole run with cProfile, writing the stats to the profile stats file. Also writes the stage report.")
+    for name in get_overridable_settings():
+        parser.add_argument("--" + name.replace("_", "-"), dest = name, metavar = "DIR", help = "Overrides {} (currently '{}').".format(name, getattr(provincialsettings, name)))
+    return parser
+
+# Parse the command line (with the argued parser, or the shared one if none is argued), and apply any overridden settings. Returns the parsed arguments.
+def parse_arguments(description, parser = None):
+    if parser is None:
+        parser = get_argument_parser(description)
+    arguments = parser.parse_args()
+
+    overrides = {name : getattr(arguments, name) for name in get_overridable_settings() if getattr(arguments, name) is not None}
+    if arguments.headless:
+        overrides["headless"] = True
+    if not arguments.show_progress:
+        overrides["show_progress"] = False
+    apply_settings_overrides(overrides)
+
+    if arguments.report or arguments.profile:
+        start_instrumentation(arguments.profile)
+    return arguments
+
+# Start recording the stages of this run, and (if profile is true) profiling it with cProfile. The report and stats are written when the run exits, however it exits.
+def start_instrumentation(profile):
+    script_name = os.path.basename(sys.argv[0])
+    provincialprofiler.start_recording(provincialsettings.report_stage_memory)
+    atexit.register(provincialprofiler.write_report, provincialsettings.stage_report_dir, script_name)
+
+    if profile:
+        profiler = cProfile.Profile()
+        atexit.register(stop_profiling, profiler, provincialsettings.profile_stats_dir)
+        profiler.enable()
+
+# Stop the argued profiler, and write its stats to the argued directory.
+def stop_profiling(profiler, stats_dir):
+    profiler.disable()
+    stats_folder = os.path.dirname(stats_dir)
+    if stats_folder != "":
+        os.makedirs(stats_folder, exist_ok = True)
+    profiler.dump_stats(stats_dir)
+    print("\nProfile stats written to '{}'.".format(stats_dir))
+
+# Apply the argued settings (keyed by name) to the settings module, and to every Provincial module that imported them from it.
+# Each directory that the settings file builds from another one is rebuilt from its own assignment, so that it follows an overridden directory. Nothing else in the settings file is run again.
+def apply_settings_overrides(overrides):
+    if len(overrides) == 0:
+        return
+
+    setting_names = get_overridable_settings() + ["headless", "show_progress"]
+    previous_values = {name : getattr(provincialsettings, name) for name in setting_names}
+    for name in overrides:
+        setattr(provincialsettings, name, overrides[name])
+
+    with open(provincialsettings.__file__, "r") as settings_file:
+        settings_tree = ast.parse(settings_file.read())
+    for statement in settings_tree.body:
+        if not isinstance(statement, ast.Assign):
+            continue
+        target_names = [t.id for t in statement.targets if isinstance(t, ast.Name)]
+        if len(target_names) == len(statement.targets) and all(name in previous_values and name not in overrides for name in target_names):
+            value = eval(compile(ast.Expression(statement.value), provincialsettings.__file__, "eval"), vars(provincialsettings))
+            for name in target_names:
+                setattr(provincialsettings, name, value)
+
+    # A module holds its own copy of each setting it imported, so the copies held by Provincial's own modules (those beside this one or the settings file, including the running script)
+    # are replaced too. Other loaded modules are never touched.
+    changed_names = [name for name in setting_names if getattr(provincialsettings, name) != previous_values[name]]
+    provincial_folders = {os.path.dirname(os.path.abspath(__file__)), os.path.dirname(os.path.abspath(provincialsettings.__file__))}
+    for module in list(sys.modules.values()):
+        module_file = getattr(module, "__file__", None)
+        if module is provincialsettings or module_file is None or os.path.dirname(os.path.abspath(module_file)) not in provincial_folders:
+            continue
+        module_globals = vars(module)
+        for name in changed_names:
+            if name in module_globals:
+                module_globals[name] = getattr(provincialsettings, name)
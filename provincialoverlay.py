@@ -0,0 +1,48 @@
+# Provincial: Province handling tool for Hearts of Iron IV
+# Thomas Slade, 2020
+
+# Debug overlays shared by every script: diagonal stripes colored by the label beneath them, and 'donut' dots marking points of interest.
+# Each overlay is painted over a whole image at once, through masks and index arrays, rather than one pixel at a time.
+
+import numpy as numpy
+from provincialprofiler import timed
+
+# The offsets ([y, x]) of every pixel of a 3x3 dot from its centre.
+dot_offsets = numpy.array([[y, x] for y in (-1, 0, 1) for x in (-1, 0, 1)], dtype = numpy.int64)
+
+# Get the mask of the pixels covered by diagonal stripes on an image of the argued shape: those where (x + y) % 5 is 3 or 4.
+# Each mask is only built once per shape, since every overlay on the same map shares it.
+def get_stripe_mask(shape):
+    shape = tuple(shape[0:2])
+    stripe_mask = stripe_masks.get(shape)
+    if stripe_mask is None:
+        # The sum is taken of each coordinate's remainder, so that the sums stay small enough for uint8 however large the map is.
+        periods = (numpy.arange(shape[0]) % 5).astype(numpy.uint8)[:, None] + (numpy.arange(shape[1]) % 5).astype(numpy.uint8)[None, :]
+        stripe_mask = periods % 5 >= 3
+        stripe_masks[shape] = stripe_mask
+    return stripe_mask
+
+# Paint diagonal stripes over the argued image, colored by the label beneath each striped pixel: a pixel of label l is painted in palette[l].
+# The palette is an array (or list) of RGB colors indexed by label, such as the display color of each province's terrain.
+@timed()
+def paint_stripes(image, labels, palette):
+    stripe_mask = get_stripe_mask(labels.shape)
+    image[stripe_mask] = numpy.asarray(palette, dtype = numpy.uint8)[labels[stripe_mask]]
+
+# Paint the argued color onto the pixels at the argued rows and columns of the image. Pixels outside the image's bounds are skipped.
+def paint_pixels(image, rows, columns, color):
+    rows = numpy.asarray(rows, dtype = numpy.int64)
+    columns = numpy.asarray(columns, dtype = numpy.int64)
+    in_bounds = (rows >= 0) & (rows < image.shape[0]) & (columns >= 0) & (columns < image.shape[1])
+    image[rows[in_bounds], columns[in_bounds]] = color
+
+# Stamp a 3x3 'donut' dot (an outline around a single centre pixel) onto the argued image, centred on each of the argued coordinates ([y, x]). Dots are clipped to the image's bounds.
+# Every outline is painted before any centre, so that a dot's centre is never hidden under the outline of a dot next to it.
+def stamp_dots(image, centres, centre_col, outline_col):
+    centres = numpy.asarray(centres, dtype = numpy.int64).reshape(-1, 2)
+    outline_pixels = (centres[:, None, :] + dot_offsets[None, :, :]).reshape(-1, 2)
+    paint_pixels(image, outline_pixels[:, 0], outline_pixels[:, 1], outline_col)
+    paint_pixels(image, centres[:, 0], centres[:, 1], centre_col)
+
+### Globals ###
+stripe_masks = {}   # The stripe mask of each image shape built so far, keyed by shape.
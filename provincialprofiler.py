@@ -0,0 +1,171 @@
+# Provincial: Province handling tool for Hearts of Iron IV
+# Thomas Slade, 2020
+
+# Instrumentation shared by every script: timed spans around the stages of a run, counters of the work each stage did, and the peak memory each stage allocated.
+# Spans nest, and each is recorded under the path of the spans it was opened within (such as 'fill states/fill_state/get_provinces'), totalled over every time it was opened.
+# Nothing is recorded until recording is started (by running a script with '--report' or '--profile'), so instrumented code runs at full speed otherwise.
+
+import functools
+import json
+import os
+import time
+import tracemalloc
+
+# A span that is currently open.
+class OpenSpan:
+    __slots__ = ("path", "start_time", "start_bytes", "peak_bytes")
+
+    def __init__(self, path, start_time, start_bytes):
+        self.path = path
+        self.start_time = start_time
+        self.start_bytes = start_bytes    # The memory that was allocated when the span was opened.
+        self.peak_bytes = start_bytes   # The most memory that has been allocated at once while the span was open.
+
+# A timed span around a stage of a run, used as a 'with' block. Does nothing unless recording has been started.
+# Once the block is left, the span holds the seconds it took and the peak memory it allocated.
+class TimedSpan:
+    __slots__ = ("name", "seconds", "peak_bytes")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0
+        self.peak_bytes = 0
+
+    def __enter__(self):
+        if recording:
+            open_span(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if recording and len(open_spans) > 0:
+            self.seconds, self.peak_bytes = close_span()
+        return False
+
+# Time the code within a 'with' block as a span of the argued name.
+def timed_span(name):
+    return TimedSpan(name)
+
+# Decorate a function so that every call to it is timed as a span of the argued name (or the function's own name, if none is argued).
+def timed(name = None):
+    def decorate(function):
+        span_name = name if name is not None else function.__name__
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            if not recording:
+                return function(*args, **kwargs)
+            with timed_span(span_name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorate
+
+# Start recording spans and counters. If trace_memory is true, the peak memory of each span is also recorded, which slows the run down.
+# Anything recorded before (such as by the process that a worker process was forked from) is cleared.
+def start_recording(trace_memory = False):
+    global recording, run_start_time, span_records, counters
+    recording = True
+    open_spans.clear()
+    span_records = {}
+    counters = {}
+    run_start_time = time.perf_counter()
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+# Whether or not the peak memory of each span is being recorded.
+def is_tracing_memory():
+    return tracemalloc.is_tracing()
+
+# Get the memory that is currently allocated, and the most that has been allocated at once since the peak was last reset. Both are 0 if memory isn't being traced.
+def get_traced_memory():
+    return tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+
+# Open a span of the argued name within the innermost open span.
+def open_span(name):
+    current_bytes, peak_bytes = get_traced_memory()
+    if len(open_spans) > 0:
+        parent = open_spans[-1]
+        parent.peak_bytes = max(parent.peak_bytes, peak_bytes)
+        path = parent.path + "/" + name
+    else:
+        path = name
+
+    # The peak is reset for each span, so that the peak seen when it closes belongs to the span alone. Its parent folds the peak in above, and again when the span closes.
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    open_spans.append(OpenSpan(path, time.perf_counter(), current_bytes))
+
+# Close the innermost open span, and add its time and peak memory to its record. Returns the span's time and peak memory.
+def close_span():
+    span = open_spans.pop()
+    seconds = time.perf_counter() - span.start_time
+    span.peak_bytes = max(span.peak_bytes, get_traced_memory()[1])
+    if len(open_spans) > 0:
+        open_spans[-1].peak_bytes = max(open_spans[-1].peak_bytes, span.peak_bytes)
+
+    peak_bytes = max(0, span.peak_bytes - span.start_bytes)
+    add_span_record(span.path, 1, seconds, peak_bytes)
+    return seconds, peak_bytes
+
+# Add the argued calls, seconds and peak memory to the record of the span at the argued path.
+def add_span_record(path, calls, seconds, peak_bytes):
+    record = span_records.get(path)
+    if record is None:
+        span_records[path] = {"calls" : calls, "seconds" : seconds, "peak_bytes" : peak_bytes}
+    else:
+        record["calls"] += calls
+        record["seconds"] += seconds
+        record["peak_bytes"] = max(record["peak_bytes"], peak_bytes)
+
+# Add the argued amount to the counter of the argued name, such as the number of states filled or provinces assigned.
+def count(name, amount = 1):
+    if recording:
+        counters[name] = counters.get(name, 0) + amount
+
+# Take every span and counter recorded so far, clearing them. Used by worker processes to hand their records back to the main process.
+def take_records():
+    global span_records, counters
+    records = (span_records, counters)
+    span_records = {}
+    counters = {}
+    return records
+
+# Add records taken from another process with take_records. Its spans are placed within whichever span is currently open in this process.
+# Spans from several processes at once are totalled, so their seconds may add up to more than the time that actually passed.
+def merge_records(records):
+    if not recording:
+        return
+    merged_spans, merged_counters = records
+    path_prefix = open_spans[-1].path + "/" if len(open_spans) > 0 else ""
+    for path in merged_spans:
+        record = merged_spans[path]
+        add_span_record(path_prefix + path, record["calls"], record["seconds"], record["peak_bytes"])
+    for name in merged_counters:
+        count(name, merged_counters[name])
+
+# Get the report of everything recorded so far, as a dictionary that can be written as JSON.
+def get_report(script_name):
+    report = {"script" : script_name, "seconds" : time.perf_counter() - run_start_time, "memory_traced" : tracemalloc.is_tracing(), "spans" : {}, "counters" : dict(counters)}
+    for path in sorted(span_records):
+        report["spans"][path] = dict(span_records[path])
+    return report
+
+# Write the report of everything recorded so far to the argued directory.
+def write_report(report_dir, script_name):
+    if not recording:
+        return
+    while len(open_spans) > 0:
+        close_span()
+
+    report_folder = os.path.dirname(report_dir)
+    if report_folder != "":
+        os.makedirs(report_folder, exist_ok = True)
+    with open(report_dir, "w+") as report_file:
+        json.dump(get_report(script_name), report_file, indent = 4)
+    print("\nStage report written to '{}'.".format(report_dir))
+
+### Globals ###
+recording = False   # Whether or not spans and counters are being recorded.
+run_start_time = None
+open_spans = []  # The spans that are currently open, innermost last.
+span_records = {}   # The calls, total seconds and peak memory of each span, keyed by its path.
+counters = {}   # The total of each counter, keyed by name.
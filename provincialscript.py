@@ -0,0 +1,199 @@
+# Provincial: Province handling tool for Hearts of Iron IV
+# Thomas Slade, 2020
+
+# Reading and editing of Paradox (Clausewitz) script files, such as state, strategic region and supply area files.
+# A script is split into tokens once, and every token (including whitespace and comments) is kept, so that writing the script back reproduces its original formatting exactly.
+# Edits are made to the tokens in place, and the script is only joined back into text once, when it's written.
+
+import re
+
+# Whitespace, comments, quoted strings, operators and words (anything else). Every character of a script falls into exactly one of these.
+token_pattern = re.compile(r'(?P<space>\s+)|(?P<comment>#[^\n]*)|(?P<string>"(?:[^"\\]|\\.)*"?)|(?P<operator>[<>!]=|[=<>{}])|(?P<word>[^\s#"=<>!{}]+|!)')
+assignment_operators = {"=", "<", ">", "<=", ">=", "!="}
+
+# A 'name = value' or 'name = { ... }' entry in a script. All indices point into the tokens of the script the field belongs to.
+class ScriptField:
+    __slots__ = ("name", "key_index", "operator_index", "open_index", "close_index", "is_table", "depth", "deleted", "content_override")
+
+    def __init__(self, name, key_index, operator_index, open_index, close_index, is_table, depth):
+        self.name = name
+        self.key_index = key_index
+        self.operator_index = operator_index
+        self.open_index = open_index    # For tables, the index of the '{' token. For other fields, the index of the value token (or of the operator, if the field has no value).
+        self.close_index = close_index  # For tables, the index of the '}' token. For other fields, the same as the open index.
+        self.is_table = is_table
+        self.depth = depth  # How many tables this field is nested within.
+        self.deleted = False
+        self.content_override = None    # The content that replaced the field's original content, if it has been edited.
+
+# A single script file. The script is only tokenized and parsed the first time it's read from or edited.
+class ScriptDocument:
+    def __init__(self, script):
+        self.script = script
+        self.tokens = None  # The text of each token. Editing never changes the number of tokens, so field indices remain valid after an edit.
+        self.kinds = None   # The kind of each token ('space', 'comment', 'string', 'operator' or 'word').
+        self.fields = None  # Every field in the script, in the order that they appear.
+
+    # Split the script into tokens, and find each field within those tokens.
+    def parse(self):
+        if self.tokens is not None:
+            return
+
+        self.tokens = []
+        self.kinds = []
+        for match in token_pattern.finditer(self.script):
+            self.tokens.append(match.group())
+            self.kinds.append(match.lastgroup)
+
+        significant = [t for t in range(len(self.tokens)) if self.kinds[t] != "space" and self.kinds[t] != "comment"]
+        self.fields = []
+        open_tables = []    # The table fields (or None for anonymous tables) that the parser is currently within.
+
+        s = 0
+        while s < len(significant):
+            token = self.tokens[significant[s]]
+
+            if token == "}" and self.kinds[significant[s]] == "operator":
+                if len(open_tables) > 0:
+                    table = open_tables.pop()
+                    if table is not None:
+                        table.close_index = significant[s]
+                s += 1
+            elif token == "{" and self.kinds[significant[s]] == "operator":
+                open_tables.append(None)
+                s += 1
+            elif self.kinds[significant[s]] != "operator" and s + 1 < len(significant) and self.tokens[significant[s + 1]] in assignment_operators:
+                key_index = significant[s]
+                operator_index = significant[s + 1]
+                value = significant[s + 2] if s + 2 < len(significant) else None
+
+                if value is not None and self.tokens[value] == "{":
+                    field = ScriptField(token, key_index, operator_index, value, len(self.tokens), True, len(open_tables))
+                    open_tables.append(field)
+                    s += 3
+                # A value followed by an operator is actually the name of the next field, in which case this field was left empty (like 'name=' in the state template).
+                elif (value is not None and self.kinds[value] != "operator"
+                      and not (s + 3 < len(significant) and self.tokens[significant[s + 3]] in assignment_operators)):
+                    field = ScriptField(token, key_index, operator_index, value, value, False, len(open_tables))
+                    s += 3
+                else:
+                    field = ScriptField(token, key_index, operator_index, operator_index, operator_index, False, len(open_tables))
+                    s += 2
+
+                self.fields.append(field)
+            else:
+                # A bare value, such as a province ID in a list.
+                s += 1
+
+    # Get the first field of the argued name (matching the whole name) in the script, or None if there is no such field.
+    def get_field(self, field_name, is_table = False):
+        self.parse()
+        for field in self.fields:
+            if field.name == field_name and field.is_table == is_table and not field.deleted:
+                return field
+        return None
+
+    # Get the string content following a field of the argued name in this script, with tabs, newlines and comments collapsed into single spaces.
+    # Returns None if there is no such field.
+    def get_field_content(self, field_name, is_table = False):
+        field = self.get_field(field_name, is_table)
+        if field is None:
+            return None
+        if field.content_override is not None:
+            return " ".join(field.content_override.split())
+
+        if field.is_table:
+            content_tokens = range(field.open_index + 1, field.close_index)
+        elif field.open_index == field.operator_index:
+            content_tokens = []
+        else:
+            content_tokens = [field.open_index]
+
+        return " ".join(self.tokens[t] for t in content_tokens if self.kinds[t] != "space" and self.kinds[t] != "comment")
+
+    # Set the string content following a field of the argued name in this script. Tables are written over several lines, indented to match the field.
+    def set_field_content(self, field_name, new_content, is_table = False):
+        field = self.get_field(field_name, is_table)
+        if field is None:
+            raise Exception("Cannot set the field of name '{}' because such a field with the appropriate opening format was not found in ths script.".format(field_name))
+
+        if field.is_table:
+            tab_string = "\t" * self.get_indentation(field.key_index)
+            # The new content is kept with the opening brace, and everything that was between the braces is blanked out.
+            self.tokens[field.open_index] = "{\n" + tab_string + "\t" + new_content + "\n" + tab_string
+            self.clear_tokens(field.open_index + 1, field.close_index)
+            self.delete_nested_fields(field)
+        elif field.open_index == field.operator_index:
+            self.tokens[field.operator_index] = self.tokens[field.operator_index] + new_content
+        else:
+            self.tokens[field.open_index] = new_content
+
+        field.content_override = new_content
+
+    # Delete a field and its content of the argued name in this script, along with the line it sat on (unless other content follows the field on that line).
+    def delete_field(self, field_name, is_table = False):
+        field = self.get_field(field_name, is_table)
+        if field is None:
+            return
+
+        # Remove the indentation before the field, and the newline before that.
+        start = field.key_index
+        while start > 0 and self.kinds[start - 1] == "space":
+            start -= 1
+            if "\n" in self.tokens[start]:
+                self.tokens[start] = self.tokens[start][0:self.tokens[start].rfind("\n")]
+                start += 1
+                break
+
+        end = min(field.close_index, len(self.tokens) - 1)
+        self.clear_tokens(start, end + 1)
+        field.deleted = True
+        self.delete_nested_fields(field)
+
+    # Get the number of tabs that the line holding the argued token is indented by.
+    def get_indentation(self, token_index):
+        line_start = token_index
+        while line_start > 0 and "\n" not in self.tokens[line_start - 1]:
+            line_start -= 1
+
+        if line_start == 0 or self.kinds[line_start - 1] != "space":
+            return 0
+        indentation = self.tokens[line_start - 1]
+        return indentation[indentation.rfind("\n") + 1:].count("\t")
+
+    # Get the text of the first comment starting with the argued prefix, excluding the prefix. Returns None if there is no such comment.
+    def get_comment(self, prefix):
+        self.parse()
+        for t in range(len(self.tokens)):
+            if self.kinds[t] == "comment" and self.tokens[t].startswith(prefix):
+                return self.tokens[t][len(prefix):]
+        return None
+
+    # Blank out the tokens in the argued range.
+    def clear_tokens(self, start, end):
+        for t in range(start, end):
+            self.tokens[t] = ""
+
+    # Mark all fields nested within the argued table as deleted, since their tokens have been replaced.
+    def delete_nested_fields(self, table):
+        if not table.is_table:
+            return
+        for field in self.fields:
+            if field is not table and field.key_index > table.open_index and field.key_index < table.close_index:
+                field.deleted = True
+
+    # Get the full text of the script, including any edits.
+    def get_text(self):
+        if self.tokens is None:
+            return self.script
+        return "".join(self.tokens)
+
+# Read the script file at the argued directory.
+def read_script(file_dir):
+    with open(file_dir, "r") as script_file:
+        return ScriptDocument(script_file.read())
+
+# Write the argued script document to the argued directory.
+def write_script(file_dir, document):
+    with open(file_dir, "w+") as script_file:
+        script_file.write(document.get_text())
@@ -6,12 +6,33 @@
 # All directories are relative to the location of the scripts themselves.
 inputs_dir = "Workspace/"   # Root directory for all input images and files. Leave blank if you have no unified area you want to work.
 outputs_dir = "Workspace/" # Root directory for all files and images created by Provincial. This may also be left blank, and can also equal the inputs_directory for ease of use.
+headless = False    # If true, scripts never open a window to display their output (or import matplotlib to do so). Can also be set with '--headless' when running a script.
+show_progress = True    # If true, long loops (such as over every province) report their progress, rate and time remaining. Can also be turned off with '--no-progress'.
+progress_interval = 0.5 # The number of seconds between each progress report.
+
+# Decoded maps (their label images, color tables and province statistics) are cached here, keyed by the content of the map file. A map that hasn't changed since the last run
+# is loaded from the cache instead of being decoded and labelled again. Delete this directory at any time to clear the cache.
+use_map_cache = True
+cache_dir = outputs_dir + "Cache/"
+cache_max_bytes = 2 * 1024 ** 3 # The maximum size of the cache directory. When it grows past this, the least recently used entries are deleted.
+# For maps too large to hold in memory. If above 0, whole-map passes work through maps this many rows at a time, BMP maps are memory-mapped rather than read into memory,
+# and large working arrays are kept in temporary files in the cache directory. This keeps memory use bounded whatever the map size, at some cost to speed. 0 processes maps whole.
+tile_rows = 0
+# Running any script with '--report' records how long each stage of the run took, along with counts of the states and provinces it handled, and writes them to the stage report.
+# '--profile' also profiles every function call with cProfile, and writes the stats to the profile stats file (which can be read by pstats, snakeviz or flamegraph tools).
+stage_report_dir = outputs_dir + "StageReport.json"
+profile_stats_dir = outputs_dir + "Profile.prof"
+report_stage_memory = True  # If true, the stage report also records the peak memory of each stage. Tracing memory slows the run down, so stage times are less accurate with this on.
 
 ### fillprovinces.py ###
 province_outlines_dir = inputs_dir + "ProvinceOutlines.bmp"  # Directory of the image used to define the outlines of a state and its borders. This is what's filled in with unique province colours.
 # Optional directory of an existing map, which can be used to prevent duplicate province colors in the filled-province output image, if you're doing just a few states at a time.
 existing_provinces_dir = inputs_dir + "ExistingProvinces.bmp"
 filled_provinces_dir = outputs_dir + "FilledProvinces.bmp"    # Directory of the output image, containing the filled provinces.
+# If true, only the states whose outlines have changed since the previous fill are filled again, and every other state keeps its colors from the previous output.
+# The previous fill is described by the fill record, which is written alongside the output. If the output has been edited since, or the fill settings (or random_seed) have changed, every state is filled.
+incremental_fill = False
+fill_record_dir = outputs_dir + "FillRecord.json"
 # Special color Defines. These colors can't be used as province colors, as they serve a special purpose in reading the province guide.
 ignore_col = (0, 0, 0)   # The color indicating that no operation needs to be done (will be filled black in the output).
 paint_over_col = (255, 255, 255) # The color of areas that must be filled in with province colors.
@@ -27,14 +48,20 @@ random_state_palette_colors = False
 hue_variation = 0.05  # How much hue can vary by.
 sat_variation = 0.5  # The max value that saturation can vary by.
 val_variation = 0.5  # The max value that value can vary by.
-# Whether or not this script should record and play an animation (warning: recording can be very intensive, and is best done with smaller images for testing).
+# Whether or not this script should record and play an animation. Only the pixels that change between frames are recorded, but recording still slows the filling down considerably.
 record_animation = False
+animation_stream_dir = ""   # If set, recorded frames are streamed to this file rather than held in memory, which keeps memory use flat when animating a whole map.
 open_in_fullscreen = False  # Whether or not the output image should be opened in fullscreen (nice for getting gifs).
 # 0 = Pixels that did not directly link to a larger province(which are probably just cut off by border definitions) will be filled with grey and marked on the debug map.
 # 1 = If an undetermined pixel borders only 1 other color in its state, it will be assigned that color.
 # 2 = An undetermined pixel will be assigned to the color it neighbors the most.
 undetermined_pixel_handling = 2
+# The number of processes that states are filled across at once. 1 fills states one at a time, and 0 uses one process for each CPU core.
+fill_process_count = 1
 random_col_generation_attempts = 20 # How many times the program is allowed to try and generate a random new color that isn't already used on the map before throwing an error.
+# The number of hue, saturation and value steps that a palette's variation envelope is split into. Each palette can give out at most this number cubed colors (fewer for grey palettes).
+palette_pool_steps = 24
+random_seed = None  # The seed that province colors are generated from. The same seed, settings and guide always produce the same colors. None uses a different seed every run.
 
 ### validatemap.py ###
 # The number of pixels a province must be less than or equal to in order to be considered excessively small. This ought to be the number that HoI flags when launching in debug mode (8 pixels).
@@ -86,10 +113,39 @@ peak_col = (1, 0, 1)
 hills_slope_minimum = 0.6
 mountains_slope_minimum = 0.9
 
+### generatesyntheticmap.py ###
+synthetic_output_dir = outputs_dir + "Synthetic/"   # Directory that the synthetic map's images and mod files are written to.
+synthetic_map_size = (5632, 2048)   # The width and height of the synthetic map. The vanilla HoI IV province map is 5632x2048.
+synthetic_pixels_per_province = 850 # The average size of a synthetic province. Vanilla has roughly 13,000 provinces, which is about 850 pixels each.
+synthetic_provinces_per_state = 12  # The average number of land provinces in each synthetic state.
+synthetic_sea_fraction = 0.35   # The fraction of synthetic provinces that are sea.
+synthetic_map_seed = 0  # The random seed used to generate the synthetic map. The same seed and settings always produce the same map.
+
+### benchmarkprovinces.py ###
+# The map sizes (width, height) that each pipeline is benchmarked at, using synthetic maps generated with the settings above. Add (5632, 2048) to benchmark at the vanilla map size.
+benchmark_sizes = [(704, 256), (1408, 512), (2816, 1024)]
+benchmark_output_dir = outputs_dir + "Benchmarks/"  # Directory that benchmark results are written to.
+benchmark_baseline_dir = benchmark_output_dir + "Baseline.json"  # Results to compare each benchmark run against. The first run's results are saved here if the file doesn't exist yet.
+benchmark_slowdown_tolerance = 1.25 # How many times slower than its baseline a stage may be before it's reported as a regression.
+benchmark_pixels_per_fragment = 1000    # The number of map pixels to each province fragment drawn onto the guide that fragment resolution is benchmarked on. Fragments are close enough together that some touch.
+
 ### generatedefinitions.py ###
 terrain_map_dir = inputs_dir + "Terrain.bmp" # The name of the terrain map used to inform this script of what terrain type occupies each province.
 edit_existing_definitions = True # If true, generatedefinitions will write its output to the existing definitions.csv file. Otherwise, you can always copy and paste the output definitions from the console once you're sure they're correct.
 definitions_output_dir = outputs_dir + "definitions_generated.csv" # The directory of the existing definitions file.
+continent_map_dir = inputs_dir + "Continents.bmp" # An optional map painting each continent in the color given in the 'continents' dictionary below. Without one, every province is given the default continent.
+default_continent = 1 # The continent given to provinces when there's no continent map, or when none of a province's pixels are of a color in the 'continents' dictionary.
+
+# Bind each continent number (as listed in HoI IV's map/continent.txt file, counting up from 1) to the RGB key it's painted with on the continent map.
+# Continent 0 means no continent, which HoI IV gives to sea provinces. Colors with no entry here are given the default continent.
+continents = { (0, 0, 0) : 0,
+               (255, 0, 0) : 1,
+               (0, 255, 0) : 2,
+               (0, 0, 255) : 3,
+               (255, 255, 0) : 4,
+               (255, 0, 255) : 5,
+               (0, 255, 255) : 6,
+               (255, 128, 0) : 7 }
 
 # Universal terrain object definitions.
 class TerrainData:
@@ -3,41 +3,227 @@
 
 # Common functions for image manipulation in the Provincial tool.
 
+import copy
+import os
+import struct
+import sys
+import tempfile
+import time
 import numpy as numpy
-from numpy import arange
-from skimage import data, io
-from skimage.segmentation import flood, flood_fill
-from numpy import logical_and, logical_or
+from PIL import Image
+from scipy import ndimage, sparse
 from provincialsettings import *
+from provincialscript import *
+from provincialprofiler import timed
+
+### Packed Color Methods ###
+# Colors are packed into a single uint32 key of the form 0x00RRGGBB. Comparing, sorting and hashing one key per pixel is far cheaper than doing so on three separate channels.
+# Maps with more pixels than this use a dense lookup table covering every possible key when building a label image, rather than sorting the keys.
+dense_label_threshold = 1 << 22
+packed_color_count = 1 << 24
+
+# Packs the RGB channels of an image (or an array of colors) into one uint32 key per pixel. Any alpha channel is ignored.
+def pack_colors(image):
+    image = numpy.asarray(image)
+    return (image[..., 0].astype(numpy.uint32) << 16) | (image[..., 1].astype(numpy.uint32) << 8) | image[..., 2].astype(numpy.uint32)
+
+# Packs a single color into its integer key.
+def pack_color(color):
+    return (int(color[0]) << 16) | (int(color[1]) << 8) | int(color[2])
+
+# Unpacks an array of keys into an array of RGB colors with an extra trailing axis of size 3.
+def unpack_colors(keys):
+    keys = numpy.asarray(keys, dtype = numpy.uint32)
+    colors = numpy.empty(keys.shape + (3,), dtype = numpy.uint8)
+    colors[..., 0] = keys >> 16
+    colors[..., 1] = (keys >> 8) & 0xFF
+    colors[..., 2] = keys & 0xFF
+    return colors
+
+# Unpacks a single key into an RGB tuple.
+def unpack_color(key):
+    key = int(key)
+    return (key >> 16, (key >> 8) & 0xFF, key & 0xFF)
+
+# An image whose colors have been replaced by labels. Each label is an index into a table of the image's unique colors, which is sorted by packed key.
+# Built once per image, this replaces calls to numpy.unique(..., axis = 0) and per-pixel comparisons of RGB triplets.
+# If a color table of packed keys is argued, the image is taken to already be a label image indexing that table (such as one loaded from the cache).
+# When processing in tiles, an image taller than a tile is labelled one band of rows at a time, writing into labels_out if it's argued (such as a memory-mapped array).
+class LabelImage:
+    @timed("LabelImage")
+    def __init__(self, image, keys = None, labels_out = None):
+        if keys is not None:
+            self.labels = image
+            self.keys = keys
+            self.colors = unpack_colors(self.keys)
+            self.shape = self.labels.shape
+            self.cache_entry = None
+            return
+
+        if tile_rows > 0 and image.shape[0] > tile_rows:
+            self.keys, self.labels = get_banded_labels(image, labels_out)
+            self.colors = unpack_colors(self.keys)
+            self.shape = self.labels.shape
+            self.cache_entry = None
+            return
+
+        keys = get_image_keys(image)
+
+        if keys.size > dense_label_threshold:
+            # For large maps, mark every key that is present in a table covering all possible colors. This avoids sorting the whole map.
+            present = numpy.zeros(packed_color_count, dtype = bool)
+            present[keys.ravel()] = True
+            self.keys = numpy.flatnonzero(present).astype(numpy.uint32)
+            del present
+            lookup = numpy.zeros(packed_color_count, dtype = numpy.int32)
+            lookup[self.keys] = numpy.arange(len(self.keys), dtype = numpy.int32)
+            self.labels = lookup[keys]
+        else:
+            self.keys, inverse = numpy.unique(keys.ravel(), return_inverse = True)
+            self.labels = inverse.reshape(keys.shape).astype(numpy.int32)
+
+        self.colors = unpack_colors(self.keys)
+        self.shape = self.labels.shape
+        self.cache_entry = None # The cache entry directory that this label image was loaded from or saved to, if any.
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Get the label of each of the argued packed keys. Keys that don't appear in the image are given a label of -1.
+    def get_labels(self, keys):
+        keys = numpy.asarray(keys, dtype = numpy.uint32)
+        indices = numpy.searchsorted(self.keys, keys)
+        indices = numpy.minimum(indices, max(len(self.keys) - 1, 0))
+        found = len(self.keys) > 0 and self.keys[indices] == keys
+        return numpy.where(found, indices, -1)
+
+    # Get the label of a single color, or -1 if the color doesn't appear in the image.
+    def get_label(self, color):
+        return int(self.get_labels(pack_color(color)))
+
+    # Get the RGB tuple of the argued label.
+    def get_color(self, label):
+        return tuple(int(c) for c in self.colors[label])
+
+    # Get a copy of this label image with its labels replaced by the argued array, which must index the same color table.
+    def with_labels(self, labels):
+        label_image = copy.copy(self)
+        label_image.labels = labels
+        label_image.shape = labels.shape
+        label_image.cache_entry = None
+        return label_image
+
+    # Get the RGB image that this label image represents.
+    def get_image(self):
+        return self.colors[self.labels]
+
+    # Get the packed color key of every pixel.
+    def get_keys(self):
+        return self.keys[self.labels]
+
+    # Get a mask of all pixels of the argued color.
+    def get_mask(self, color):
+        label = self.get_label(color)
+        if label == -1:
+            return numpy.zeros(self.shape, dtype = bool)
+        return self.labels == label
+
+### Tiled Processing Methods ###
+# When tile_rows is above 0, whole-map passes work through a map one band of rows at a time, and maps are memory-mapped from disk rather than read into memory.
+# Get the (start, stop) rows of each band of the argued number of rows.
+def get_row_bands(height):
+    band_rows = tile_rows if tile_rows > 0 else max(height, 1)
+    return [(start, min(start + band_rows, height)) for start in range(0, height, band_rows)]
+
+# Get the packed color key of every pixel of an RGB image, or of an image that's already made of keys.
+def get_image_keys(image):
+    return pack_colors(image[..., 0:3]) if numpy.ndim(image) == 3 else numpy.asarray(image, dtype = numpy.uint32)
+
+# Label an image one band of rows at a time, so that only one band's keys are held in memory. The labels are written into labels_out if it's argued.
+# Returns the sorted table of the image's packed keys, and the labels indexing it.
+def get_banded_labels(image, labels_out = None):
+    bands = get_row_bands(image.shape[0])
+    present = numpy.zeros(packed_color_count, dtype = bool)
+    for start, stop in bands:
+        present[get_image_keys(image[start:stop]).ravel()] = True
+    keys = numpy.flatnonzero(present).astype(numpy.uint32)
+    del present
+
+    lookup = numpy.zeros(packed_color_count, dtype = numpy.int32)
+    lookup[keys] = numpy.arange(len(keys), dtype = numpy.int32)
+    labels = labels_out if labels_out is not None else get_work_array(image.shape[0:2], numpy.int32)
+    for start, stop in bands:
+        labels[start:stop] = lookup[get_image_keys(image[start:stop])]
+
+    return keys, labels
+
+# Get the bounding slices of every label of a label array, indexed by label (None for any label with no pixels), matching ndimage.find_objects. Found one band of rows at a time.
+# Each band is split into horizontal runs of the same label, and every label's bounds are taken from the first and last pixels of its runs with unbuffered minimums and maximums,
+# so no band is ever looped over label by label.
+def get_label_slices(labels, label_count):
+    y_min = numpy.full(label_count, labels.shape[0])
+    x_min = numpy.full(label_count, labels.shape[1])
+    y_max = numpy.full(label_count, -1)
+    x_max = numpy.full(label_count, -1)
+
+    for start, stop in get_row_bands(labels.shape[0]):
+        band = labels[start:stop]
+        run_starts = numpy.ones(band.shape, dtype = bool)
+        run_starts[:, 1:] = band[:, 1:] != band[:, :-1]
+        run_ends = numpy.ones(band.shape, dtype = bool)
+        run_ends[:, :-1] = run_starts[:, 1:]
+
+        start_rows, start_columns = numpy.nonzero(run_starts)
+        start_labels = band[start_rows, start_columns]
+        end_rows, end_columns = numpy.nonzero(run_ends)
+        end_labels = band[end_rows, end_columns]
+
+        numpy.minimum.at(y_min, start_labels, start_rows + start)
+        numpy.maximum.at(y_max, start_labels, start_rows + start + 1)
+        numpy.minimum.at(x_min, start_labels, start_columns)
+        numpy.maximum.at(x_max, end_labels, end_columns + 1)
+
+    return [(slice(int(y_min[l]), int(y_max[l])), slice(int(x_min[l]), int(x_max[l]))) if y_max[l] >= 0 else None for l in range(label_count)]
+
+# Get an uninitialised array of the argued shape and type. When processing in tiles, the array is memory-mapped from an anonymous temporary file in the cache directory, rather than held in memory.
+def get_work_array(shape, dtype):
+    if tile_rows <= 0:
+        return numpy.empty(shape, dtype = dtype)
+    os.makedirs(cache_dir, exist_ok = True)
+    return numpy.memmap(tempfile.TemporaryFile(dir = cache_dir), dtype = dtype, mode = "w+", shape = shape)
+
+# Memory-map the pixels of an uncompressed 24 or 32-bit BMP file as an RGB image, without reading them into memory. The mode is that of numpy.memmap ('r', 'r+' or 'c').
+# Returns None for any other kind of image, which must be read whole instead.
+def open_bmp(image_dir, mode = "r"):
+    with open(image_dir, "rb") as image_file:
+        header = image_file.read(34)
+    if len(header) < 34 or header[0:2] != b"BM":
+        return None
 
-# Makes a 'selection' starting at the specified startingCoord and filling out adjacent pixels of equal colour value. Returns a 2D np array where a True element indicates a pixel that was flooded.
-def flood_rgb(image, starting_coord):
-    image = image.copy()
-    width = len(image)
-    height = len(image[0])
-    # Sadly, I need to use this 'alternate color' approach because I can't get flood working with an RGB image, so I need to make several calls to flood on each color channel, using
-    # either black or white as an invalidation marker (white if the actual sample colour is black, else black).
-    alternate_col = [1, 1, 1] if (image[starting_coord[0]][starting_coord[1]] == [0, 0, 0]).all() else [0, 0, 0] 
-    
-    r_flood = flood(image, (starting_coord[0], starting_coord[1], 0), connectivity = 1)
-    for x in range(width):
-        for y in range(height):
-            if not r_flood[x, y, 0]:
-                image[x, y] = alternate_col
-    g_flood = flood(image, (starting_coord[0], starting_coord[1], 1), connectivity = 1)
-    for x in range(width):
-        for y in range(height):
-            if not g_flood[x, y, 1]:
-                image[x, y] = alternate_col
-    b_flood = flood(image, (starting_coord[0], starting_coord[1], 2), connectivity = 1)
-
-    all_flood = numpy.empty([width, height], bool)
-
-    for x in arange(width):
-        for y in arange(height):
-            all_flood[x][y] = r_flood[x, y, 0] and g_flood[x, y, 1] and b_flood[x, y, 2]
-            
-    return all_flood
+    pixel_offset, = struct.unpack_from("<I", header, 10)
+    width, height, planes, bits, compression = struct.unpack_from("<iiHHI", header, 18)
+    if bits not in (24, 32) or compression != 0 or width <= 0:
+        return None
+
+    # Rows are padded to a multiple of 4 bytes, stored bottom-up (unless the height is negative), and hold their channels in BGR order.
+    channels = bits // 8
+    row_bytes = (width * channels + 3) // 4 * 4
+    rows = numpy.memmap(image_dir, dtype = numpy.uint8, mode = mode, offset = pixel_offset, shape = (abs(height), row_bytes))
+    pixels = rows[:, 0:width * channels].reshape(abs(height), width, channels)
+    if height > 0:
+        pixels = pixels[::-1]
+    return pixels[:, :, 2::-1]
+
+# Create a black, 24-bit BMP file of the argued (height, width) shape at 100 DPI, and memory-map it for writing as an RGB image.
+def create_bmp(image_dir, shape):
+    height, width = shape[0:2]
+    row_bytes = (width * 3 + 3) // 4 * 4
+    pixels_per_metre = 3937 # 100 DPI.
+    with open(image_dir, "wb") as image_file:
+        image_file.write(struct.pack("<2sIHHI", b"BM", 54 + row_bytes * height, 0, 0, 54))
+        image_file.write(struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, row_bytes * height, pixels_per_metre, pixels_per_metre, 0, 0))
+        image_file.truncate(54 + row_bytes * height)
+    return open_bmp(image_dir, "r+")
 
 # Returns true if this color's R and B values match but its G value is different.
 def is_magenta_shade(color):
@@ -74,33 +260,395 @@ def paste(wall, block, loc):
   wall_slices, block_slices = zip(*map(paste_slices, loc_zip))
   wall[wall_slices] = block[block_slices]
 
-# Get a list of masks representing pixels belonging to distinct continuous areas in the argued mask.
+# Save the argued RGB image to the argued directory, as a 24-bit image at 100 DPI (the DPI that matplotlib used to save with).
+@timed()
+def save_image(image_dir, image):
+    Image.fromarray(numpy.ascontiguousarray(image, dtype = numpy.uint8)).save(image_dir, dpi = (100, 100))
+
+# Open a window displaying the argued image, sized to fit the map. When running headless this does nothing, and matplotlib is never imported.
+def show_image(image):
+    if headless:
+        return
+
+    import matplotlib.pyplot as pyplot
+    map_dpi = image.shape[0] / 10
+    pyplot.figure(figsize = (10, image.shape[1] / map_dpi), dpi = map_dpi)
+    pyplot.imshow(image)
+    pyplot.axis('off')
+    pyplot.show()
+
+### Progress Reporting ###
+# Reports the progress of a long loop, with its rate and estimated time remaining. Call step() once per item and finish() after the loop.
+# The report is only printed every progress_interval seconds, however fast the loop runs, so that printing never slows the loop down. Nothing is printed if show_progress is off.
+# In a terminal the report rewrites a single line. Anywhere else (such as the IDLE shell, which can't rewrite lines) each report is printed on a line of its own.
+class ProgressReporter:
+    def __init__(self, stage_name, total):
+        self.stage_name = stage_name
+        self.total = total
+        self.done = 0
+        self.start_time = time.perf_counter()
+        self.next_report_time = self.start_time + progress_interval
+        self.rewrite_line = sys.stdout.isatty()
+        self.reported_done = None   # The number of items done at the last report, or None if nothing has been reported.
+
+    # Mark the argued number of items as done, reporting the progress if it hasn't been reported for a while.
+    def step(self, amount = 1):
+        self.done += amount
+        if show_progress and time.perf_counter() >= self.next_report_time:
+            self.report()
+
+    # Report the final progress and end the report's line. Loops that finish before their first report never print anything.
+    def finish(self):
+        if show_progress and self.reported_done is not None:
+            if self.reported_done != self.done:
+                self.report()
+            if self.rewrite_line:
+                print()
+
+    # Print the progress so far.
+    def report(self):
+        current_time = time.perf_counter()
+        seconds = current_time - self.start_time
+        rate = self.done / seconds if seconds > 0 else 0
+        text = "{}: {} / {} ({:.0f}%), {:.1f}/s".format(self.stage_name, self.done, self.total, self.done / self.total * 100 if self.total > 0 else 100, rate)
+        if 0 < rate and self.done < self.total:
+            text += ", {} remaining".format(format_seconds((self.total - self.done) / rate))
+
+        if self.rewrite_line:
+            print("\r" + text.ljust(79), end = "", flush = True)
+        else:
+            print(text)
+        self.next_report_time = current_time + progress_interval
+        self.reported_done = self.done
+
+# Format a number of seconds as hours, minutes and seconds (such as '1:02:05').
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02}:{:02}".format(hours, minutes, seconds)
+
+# A continuous area of pixels, such as a province. Rather than a mask the size of the whole image, it's stored as its bounding box and a mask local to that box,
+# so that a state with hundreds of provinces doesn't need hundreds of state-sized masks.
+class ProvinceArea:
+    __slots__ = ("slices", "mask", "origin")
+
+    # The slices are the (y, x) bounding box of the area on its image, and the mask marks the area's pixels within that box.
+    def __init__(self, slices, mask):
+        self.slices = slices
+        self.mask = mask
+        # The first pixel of the area in row-major order, as [y, x] in image space.
+        local_origin = numpy.unravel_index(numpy.argmax(mask), mask.shape)
+        self.origin = [slices[0].start + int(local_origin[0]), slices[1].start + int(local_origin[1])]
+
+    # The number of pixels in the area.
+    def count(self):
+        return int(numpy.count_nonzero(self.mask))
+
+    # The bounds of the area as x_min, y_min, x_max, y_max, matching the output of find_bounds.
+    def bounds(self):
+        return self.slices[1].start, self.slices[0].start, self.slices[1].stop - 1, self.slices[0].stop - 1
+
+    # Paint the area's pixels on the argued image (which must be in the same space as the image the area was found on) with the argued color.
+    def paint(self, image, color):
+        image[self.slices][self.mask] = color
+
+    # Get the values of the argued image at each of the area's pixels.
+    def sample(self, image):
+        return image[self.slices][self.mask]
+
+    # Get the image-space coordinates of the area's pixels as y and x arrays, in the same form as numpy.where.
+    def coords(self):
+        local_y, local_x = numpy.nonzero(self.mask)
+        return local_y + self.slices[0].start, local_x + self.slices[1].start
+
+    # Iterate over the image-space coordinates of the area's pixels, as (y, x) tuples.
+    def __iter__(self):
+        return zip(*self.coords())
+
+# Get a ProvinceArea for each label in the argued label image. Labels are expected to run from first_label to first_label + area_count - 1. Labels with no pixels are given None.
+def get_label_areas(labels, area_count = None, first_label = 1):
+    # find_objects ignores label 0, and expects labels to start from 1.
+    offset_labels = labels if first_label == 1 else labels + (1 - first_label)
+    bounding_slices = ndimage.find_objects(offset_labels, area_count)
+
+    areas = []
+    for a in range(len(bounding_slices)):
+        slices = bounding_slices[a]
+        if slices is None:
+            areas.append(None)
+        else:
+            areas.append(ProvinceArea(slices, offset_labels[slices] == a + 1))
+
+    return areas
+
+# A table of statistics about every province (every label) of a LabelImage, computed for all provinces at once in a few vectorized passes over the label image.
+# Each statistic is an array column indexed by label, so scripts can read a province's facts rather than comparing the whole map against its color.
+# If a dictionary of columns is argued (such as one loaded from the cache), the statistics are taken from it instead of being computed.
+class ProvinceIndex:
+    column_names = ("areas", "centroids", "y_min", "x_min", "y_max", "x_max", "origins")
+
+    @timed("ProvinceIndex")
+    def __init__(self, label_image, columns = None):
+        self.labels = label_image.labels
+        self.colors = label_image.colors  # The RGB color of each province.
+        self.keys = label_image.keys  # The packed color of each province.
+        province_count = len(label_image)
+
+        if columns is not None:
+            for name in ProvinceIndex.column_names:
+                setattr(self, name, columns[name])
+            return
+
+        # The number of pixels in each province, and the mean pixel position of each province as [y, x]. Both are summed one band of rows at a time.
+        height, width = self.labels.shape
+        self.areas = numpy.zeros(province_count, dtype = numpy.int64)
+        position_sums = numpy.zeros((province_count, 2), dtype = numpy.float64)
+        for start, stop in get_row_bands(height):
+            flat_labels = self.labels[start:stop].ravel()
+            self.areas += numpy.bincount(flat_labels, minlength = province_count)
+            position_sums[:, 0] += numpy.bincount(flat_labels, weights = numpy.repeat(numpy.arange(start, stop, dtype = numpy.float64), width), minlength = province_count)
+            position_sums[:, 1] += numpy.bincount(flat_labels, weights = numpy.tile(numpy.arange(width, dtype = numpy.float64), stop - start), minlength = province_count)
+        with numpy.errstate(invalid = "ignore", divide = "ignore"):
+            self.centroids = position_sums / self.areas[:, None]
+
+        # The inclusive bounds of each province, and its origin (its first pixel in row-major order) as [y, x]. Provinces with no pixels are given bounds and origins of -1.
+        self.y_min = numpy.full(province_count, -1, dtype = numpy.int64)
+        self.x_min = numpy.full(province_count, -1, dtype = numpy.int64)
+        self.y_max = numpy.full(province_count, -1, dtype = numpy.int64)
+        self.x_max = numpy.full(province_count, -1, dtype = numpy.int64)
+        self.origins = numpy.full((province_count, 2), -1, dtype = numpy.int64)
+        bounding_slices = get_label_slices(self.labels, province_count)
+        for p in range(province_count):
+            slices = bounding_slices[p]
+            if slices is None:
+                continue
+            self.y_min[p], self.y_max[p] = slices[0].start, slices[0].stop - 1
+            self.x_min[p], self.x_max[p] = slices[1].start, slices[1].stop - 1
+            # The origin must be on the top row of the province's bounds.
+            self.origins[p] = [slices[0].start, slices[1].start + numpy.argmax(self.labels[slices[0].start, slices[1]] == p)]
+
+    def __len__(self):
+        return len(self.areas)
+
+    # Get every statistic column, keyed by name.
+    def get_columns(self):
+        return {name : getattr(self, name) for name in ProvinceIndex.column_names}
+
+    # The (y, x) slices of the argued province's bounding box.
+    def get_slices(self, province):
+        return slice(self.y_min[province], self.y_max[province] + 1), slice(self.x_min[province], self.x_max[province] + 1)
+
+    # The bounds of the argued province as x_min, y_min, x_max, y_max, matching the output of find_bounds.
+    def bounds(self, province):
+        return self.x_min[province], self.y_min[province], self.x_max[province], self.y_max[province]
+
+    # Get a ProvinceArea representing the pixels of the argued province.
+    def get_area(self, province):
+        slices = self.get_slices(province)
+        return ProvinceArea(slices, self.labels[slices] == province)
+
+# A sparse graph of which labels of a label array touch each other, built in one vectorized pass that compares every pixel with its right and lower neighbors (and optionally its diagonal neighbors).
+# The graph is a symmetric CSR matrix: row L holds the labels neighboring label L, and each entry is the number of neighboring pixel pairs the two labels share along their border.
+# Labels of ignored_label (such as pixels outside the area of interest) are left out of the graph.
+class AdjacencyGraph:
+    @timed("AdjacencyGraph")
+    def __init__(self, labels, label_count = None, diagonals = False, ignored_label = None):
+        if label_count is None:
+            label_count = int(labels.max()) + 1 if labels.size > 0 else 0
+        self.label_count = label_count
+
+        # The graph is built one band of rows at a time. Each band also holds the first row of the next band, so that the pairs straddling the two bands are counted.
+        height = labels.shape[0]
+        self.graph = sparse.csr_matrix((label_count, label_count), dtype = numpy.int64)
+        for start, stop in get_row_bands(height):
+            band = labels[start:min(stop + 1, height)]
+            band_rows = stop - start
+
+            # Pairs of labels that sit next to each other, as (first, second) arrays.
+            shifted_pairs = [(band[0:band_rows, :-1], band[0:band_rows, 1:]), (band[:-1, :], band[1:, :])]
+            if diagonals:
+                shifted_pairs += [(band[:-1, :-1], band[1:, 1:]), (band[:-1, 1:], band[1:, :-1])]
+
+            firsts = []
+            seconds = []
+            for first, second in shifted_pairs:
+                differs = first != second
+                if ignored_label is not None:
+                    differs &= (first != ignored_label) & (second != ignored_label)
+                firsts.append(first[differs])
+                seconds.append(second[differs])
+
+            firsts = numpy.concatenate(firsts).astype(numpy.int64)
+            seconds = numpy.concatenate(seconds).astype(numpy.int64)
+
+            # Each pair is entered in both directions, and duplicate pairs are summed into the length of their shared border.
+            rows = numpy.concatenate((firsts, seconds))
+            columns = numpy.concatenate((seconds, firsts))
+            self.graph = self.graph + sparse.csr_matrix((numpy.ones(len(rows), dtype = numpy.int64), (rows, columns)), shape = (label_count, label_count))
+        self.graph.sum_duplicates()
+
+    def __len__(self):
+        return self.label_count
+
+    # Get the labels neighboring the argued label.
+    def get_neighbors(self, label):
+        return self.graph.indices[self.graph.indptr[label]:self.graph.indptr[label + 1]]
+
+    # Get the number of neighboring pixel pairs shared with each of the argued label's neighbors, in the same order as get_neighbors.
+    def get_border_counts(self, label):
+        return self.graph.data[self.graph.indptr[label]:self.graph.indptr[label + 1]]
+
+    # Get each neighboring pair of labels once, as (first, second, border count) arrays where first < second.
+    def get_pairs(self):
+        upper = sparse.triu(self.graph, k = 1).tocoo()
+        return upper.row, upper.col, upper.data
+
+    # Get a boolean array, indexed by label, which is true for every label that neighbors any label set in the argued boolean array.
+    def neighbors_any(self, label_mask):
+        return (self.graph @ label_mask.astype(numpy.int64)) > 0
+
+    # Get a boolean array, indexed by label, which is true for every label on either side of a border between a label set in the argued boolean array and a label that isn't.
+    def get_edge_labels(self, label_mask):
+        first_labels, second_labels, border_counts = self.get_pairs()
+        crosses_edge = label_mask[first_labels] != label_mask[second_labels]
+        edge_labels = numpy.zeros(self.label_count, dtype = bool)
+        edge_labels[first_labels[crosses_edge]] = True
+        edge_labels[second_labels[crosses_edge]] = True
+        return edge_labels
+
+# An attribute layer to aggregate over the provinces of a province map, such as a terrain, continent or state map. The layer map is a LabelImage aligned with the province map.
+# Each of the layer map's labels stands for a value (by default, each label is its own value), so that several colors can count towards the same value, and labels with a value of -1
+# (such as pixels outside any state) aren't counted at all. Values may also be given weights, which their pixel counts are multiplied by when finding the weighted-dominant value.
+class AttributeLayer:
+    def __init__(self, layer_map, label_values = None, value_count = None, value_weights = None):
+        self.layer_map = layer_map
+        self.label_values = numpy.arange(len(layer_map)) if label_values is None else numpy.asarray(label_values)
+        if value_count is None:
+            value_count = int(self.label_values.max()) + 1 if len(self.label_values) > 0 else 0
+        self.value_count = value_count
+        self.value_weights = value_weights
+
+# The values of an attribute layer aggregated over every province. Each column is indexed by province label.
+# Ties between values covering as much of a province as each other are won by the lowest value.
+class LayerAggregate:
+    def __init__(self, dominant, dominant_counts, weighted_dominant, province_areas):
+        self.dominant = dominant    # The value covering the most of each province, or -1 if none of the province's pixels have a value.
+        self.dominant_counts = dominant_counts  # The number of each province's pixels that have its dominant value.
+        self.weighted_dominant = weighted_dominant  # The value with the greatest weighted pixel count in each province (the same as the dominant value if the layer has no weights).
+        with numpy.errstate(invalid = "ignore", divide = "ignore"):
+            self.purity = dominant_counts / province_areas  # The fraction of each province's pixels that have its dominant value.
+
+# Aggregate every argued layer (a dictionary of AttributeLayers, keyed by name) over the provinces of the argued province label array, in a single pass over the pixels made one band of rows
+# at a time. Each layer's (province, value) pixel counts are gathered into a joint histogram: a dense one from bincount when it's small enough, otherwise a sparse matrix.
+# Returns a dictionary of LayerAggregates, keyed by layer name.
+@timed()
+def aggregate_layers(province_labels, province_count, layers):
+    for name in layers:
+        if layers[name].layer_map.shape != province_labels.shape:
+            raise Exception("Error: The {} map is {}x{}, but the province map is {}x{}. Both maps must be the same size.".format(name, layers[name].layer_map.shape[1], layers[name].layer_map.shape[0],
+                                                                                                                             province_labels.shape[1], province_labels.shape[0]))
+
+    province_areas = numpy.zeros(province_count, dtype = numpy.int64)
+    histograms = {}
+    for name in layers:
+        histogram_size = province_count * layers[name].value_count
+        histograms[name] = numpy.zeros(histogram_size, dtype = numpy.int64) if histogram_size <= dense_label_threshold else sparse.csr_matrix((province_count, layers[name].value_count), dtype = numpy.int64)
+
+    for start, stop in get_row_bands(province_labels.shape[0]):
+        band_provinces = province_labels[start:stop].ravel().astype(numpy.int64)
+        province_areas += numpy.bincount(band_provinces, minlength = province_count)
+
+        for name in layers:
+            layer = layers[name]
+            band_values = layer.label_values[layer.layer_map.labels[start:stop].ravel()]
+            band_layer_provinces = band_provinces
+            if (band_values < 0).any():
+                has_value = band_values >= 0
+                band_values = band_values[has_value]
+                band_layer_provinces = band_provinces[has_value]
+
+            if isinstance(histograms[name], numpy.ndarray):
+                histograms[name] += numpy.bincount(band_layer_provinces * layer.value_count + band_values, minlength = len(histograms[name]))
+            else:
+                histograms[name] = histograms[name] + sparse.csr_matrix((numpy.ones(len(band_values), dtype = numpy.int64), (band_layer_provinces, band_values)),
+                                                                        shape = histograms[name].shape)
+
+    aggregates = {}
+    for name in layers:
+        layer = layers[name]
+        if isinstance(histograms[name], numpy.ndarray):
+            pair_indices = numpy.flatnonzero(histograms[name])
+            pair_provinces, pair_values, pair_counts = pair_indices // layer.value_count, pair_indices % layer.value_count, histograms[name][pair_indices]
+        else:
+            pair_histogram = histograms[name].tocoo()
+            pair_provinces, pair_values, pair_counts = pair_histogram.row, pair_histogram.col, pair_histogram.data
+
+        dominant, dominant_counts = get_row_modes(pair_provinces, pair_values, pair_counts, province_count)
+        weighted_dominant = dominant
+        if layer.value_weights is not None:
+            weighted_dominant = get_row_modes(pair_provinces, pair_values, pair_counts * numpy.asarray(layer.value_weights)[pair_values], province_count)[0]
+        aggregates[name] = LayerAggregate(dominant, dominant_counts, weighted_dominant, province_areas)
+
+    return aggregates
+
+# Get the column with the greatest value in each row of a sparse matrix, given as (row, column, value) arrays. A tie goes to the lowest column.
+# Returns the mode column of each row (-1 for empty rows) and its value (0 for empty rows).
+def get_row_modes(rows, columns, values, row_count):
+    order = numpy.lexsort((columns, -values, rows))
+    is_first = numpy.ones(len(order), dtype = bool)
+    is_first[1:] = rows[order][1:] != rows[order][:-1]
+
+    modes = numpy.full(row_count, -1, dtype = numpy.int64)
+    mode_values = numpy.zeros(row_count, dtype = values.dtype)
+    modes[rows[order][is_first]] = columns[order][is_first]
+    mode_values[rows[order][is_first]] = values[order][is_first]
+    return modes, mode_values
+
+# Label each continuous area of True pixels in the argued mask, in a single connected-component pass. Connectivity 1 joins von-Neumann neighbors, 2 also joins diagonals.
+# Returns a label image (0 outside the mask, 1 to N inside it), along with the pixel count and origin (first pixel in row-major order, as [y, x]) of each area, indexed from 0 to N - 1.
+def label_areas(mask, connectivity = 1):
+    labels, area_count = ndimage.label(mask, ndimage.generate_binary_structure(2, connectivity))
+    flat_labels = labels.ravel()
+    counts = numpy.bincount(flat_labels, minlength = area_count + 1)[1:]
+
+    # Areas are labelled in the order they're first met while scanning the image, so a pixel is an area's origin wherever its label exceeds every label scanned before it.
+    masked_indices = numpy.flatnonzero(flat_labels)
+    masked_labels = flat_labels[masked_indices]
+    previous_max = numpy.maximum.accumulate(numpy.concatenate(([0], masked_labels)))[:-1]
+    origin_indices = masked_indices[masked_labels > previous_max]
+    origins = numpy.stack(numpy.unravel_index(origin_indices, mask.shape), axis = -1)
+
+    return labels, counts, origins
+
+# Label the continuous areas of the argued mask, splitting off any with fewer than min_province_pixels pixels as undetermined.
+# Returns the label image of the remaining provinces (0 where there is no province, otherwise 1 to N), their pixel counts and origins, and a mask of the undetermined pixels.
+# If no undetermined pixels are found, the undetermined mask returns as None.
+def label_provinces(province_mask, min_province_pixels, connectivity = 1):
+    labels, counts, origins = label_areas(province_mask, connectivity)
+
+    is_small = counts < min_province_pixels
+    if not is_small.any():
+        return labels, counts, origins, None
+
+    # Mark any areas that were too small on the undetermined map (this will be re-evaluated later, allowing for diagonal pixel connections next time), then relabel the rest consecutively.
+    is_small = numpy.concatenate(([False], is_small))
+    undetermined_mask = is_small[labels]
+    relabel = numpy.zeros(len(is_small), dtype = labels.dtype)
+    relabel[~is_small] = numpy.arange(numpy.count_nonzero(~is_small))
+    labels = relabel[labels]
+
+    return labels, counts[~is_small[1:]], origins[~is_small[1:]], undetermined_mask
+
+# Get a list of ProvinceAreas representing pixels belonging to distinct continuous areas in the argued mask.
 # Any pixels belonging to a province smaller than the minimum fill pixel quantity will be added to the undetermined mask. If none are found, the undetermined mask returns as None.
+@timed()
 def get_provinces(province_mask, min_province_pixels, connectivity = 1):
-    province_masks = []
-    province_origins = []
-    undetermined_mask = numpy.zeros(province_mask.shape, dtype = bool)
-    undetermined_pixels_found = False
-
-    for x in range(province_mask.shape[0]):
-        for y in range(province_mask.shape[1]):
-            if province_mask[x][y] and ~undetermined_mask[x][y]:
-                flooded_pixels = flood(province_mask, (x, y), connectivity = connectivity)
-
-                if numpy.count_nonzero(flooded_pixels) < min_province_pixels:
-                    undetermined_pixels_found = True
-                    # If the discovered area was too small, mark it on the undetermined map (this will be re-evaluated later, allowing for diagonal pixel connections next time).
-                    undetermined_mask = numpy.logical_or(undetermined_mask, flooded_pixels)
-                else:
-                    # Remove the mask of the discovered province (found via flooding) from the province_mask, preventing it from being re-added by future iterations.
-                    province_mask = numpy.logical_and(province_mask, ~flooded_pixels)
-                    province_masks.append(flooded_pixels)
-                    province_origins.append([x, y])
-
-    if not undetermined_pixels_found:
-        undetermined_mask = None
+    labels, counts, origins, undetermined_mask = label_provinces(province_mask, min_province_pixels, connectivity)
+
+    province_areas = get_label_areas(labels, len(counts))
+    province_origins = origins.tolist()
     
-    return province_masks, province_origins, undetermined_mask
+    return province_areas, province_origins, undetermined_mask
 
 # Puts a list of numbers into a string, separated by commas.
 def list_to_string(to_string, separator = " "):
@@ -125,206 +673,191 @@ def string_to_list(to_list, separator = " "):
                 print("Error when converting the string '{}' to a list of numbers. Can '{}' be successfully parsed into an int?".format(to_list, s))
     return output
 
-# Takes a map which may have only state borders (drawn in their unique state-colors), and identifies the area encompassed by the state of the argued state_color.
-# In other words, identifies all the pixels inside or including a state's borders, essentially 'filling in' the state.
-# Also returns a mask representing the original pixels of the state_color in the guide, as well as the bounds of these pixels (x_min, y_min, x_max, y_max).
+# The area of a single state on a state guide map: the pixels inside or including its borders (the state mask) and the pixels of the border color itself (the border mask).
+# Both masks are local to the state's bounding box, which is given by its slices.
+class StateArea:
+    __slots__ = ("color", "slices", "state_mask", "border_mask")
+
+    def __init__(self, color, slices, state_mask, border_mask):
+        self.color = color
+        self.slices = slices
+        self.state_mask = state_mask
+        self.border_mask = border_mask
+
+    # The bounds of the state's border pixels as x_min, y_min, x_max, y_max, matching the output of find_bounds.
+    def bounds(self):
+        return self.slices[1].start, self.slices[0].start, self.slices[1].stop - 1, self.slices[0].stop - 1
+
+# Takes a map which may have only state borders (drawn in their unique state-colors), and identifies the area encompassed by every state on it.
+# In other words, identifies all the pixels inside or including each state's borders, essentially 'filling in' the states.
+# The state guide must be a LabelImage. The bounds of every state are found in a single pass over the guide, after which each state is only filled within its own bounding box.
+# Returns a dictionary of StateAreas keyed by state color. If state_colors is specified, only those states are returned, otherwise all colors except the ignore and paint-over colors are.
+@timed()
+def get_state_areas(state_guide, state_colors = None):
+    if state_colors is None:
+        state_colors = [state_guide.get_color(l) for l in range(len(state_guide))]
+        state_colors = [c for c in state_colors if c != tuple(ignore_col) and c != tuple(paint_over_col)]
+
+    bounding_slices = get_label_slices(state_guide.labels, len(state_guide))
+    ignore_label = state_guide.get_label(ignore_col)
+
+    state_areas = {}
+    for state_color in state_colors:
+        state_label = state_guide.get_label(state_color)
+        if state_label == -1:
+            raise Exception("The state color '{}' was not found on the state guide.".format(state_color))
+
+        slices = bounding_slices[state_label]
+        guide_view = state_guide.labels[slices]
+        border_mask = guide_view == state_label
+
+        # Fill any area that can't be reached from outside the state's bounds without crossing its border (moving through von-Neumann neighbors only).
+        # All true values on the mask signify a point on or within the state's borders.
+        state_mask = ndimage.binary_fill_holes(border_mask)
+        state_mask &= guide_view != ignore_label
+
+        state_areas[state_color] = StateArea(state_color, slices, state_mask, border_mask)
+
+    return state_areas
+
+# Identifies the area encompassed by the state of the argued state_color on the state guide (a LabelImage).
+# Returns a mask representing the pixels inside or including the state's borders, a mask representing the original pixels of the state_color in the guide,
+# and the bounds of these pixels (x_min, y_min, x_max, y_max). Both masks are cropped to those bounds.
+# Use get_state_areas instead when finding many states.
+@timed()
 def get_state_mask(state_guide, state_color):
-    # Get a mask of all pixels of the border key color.
-    # Running two_d_array == value produces a 'mask' where only individual pixels are compared, but we want to know about cases where all three pixels are equal.
-    # logical_and does this sort of thing, apparently.
-    border_mask = logical_and.reduce(state_guide == state_color, axis = -1)
+    state_area = get_state_areas(state_guide, [state_color])[state_color]
+    x_min, y_min, x_max, y_max = state_area.bounds()
 
-    x_min, y_min, x_max, y_max = find_bounds(border_mask)
-    guide_view = state_guide[y_min:y_max + 1, x_min:x_max + 1]
-    
-    # Crop the border_mask too.
-    border_mask = border_mask[y_min:y_max + 1, x_min:x_max + 1]
-
-    # Create a copy of the border mask with a new layer of false pixels all around the edge.
-    state_mask = border_mask.copy()
-    state_mask = numpy.insert(state_mask, 0, False, axis = 0)
-    state_mask = numpy.insert(state_mask, 0, False, axis = 1)
-    state_mask = numpy.insert(state_mask, state_mask.shape[0], False, axis = 0)
-    state_mask = numpy.insert(state_mask, state_mask.shape[1], False, axis = 1)
-
-    # Get a mask of all pixels outside the state's borders, by performing a flood from the top-left pixel on the expanded mask we've made.
-    # Then invert the mask. All true values on the mask signify a point on or within the state's borders.
-    state_mask = ~flood(state_mask, (0, 0), connectivity = 1)
-        
-    # Crop the state_mask back to the bounds of the relevant pixels.
-    state_mask = numpy.delete(state_mask, state_mask.shape[0] - 1, 0)
-    state_mask = numpy.delete(state_mask, state_mask.shape[1] - 1, 1)
-    state_mask = numpy.delete(state_mask, 0, 0)
-    state_mask = numpy.delete(state_mask, 0, 1)
-
-    state_mask = state_mask & logical_or.reduce(guide_view != ignore_col, axis = -1)
-
-    return state_mask, border_mask, x_min, y_min, x_max, y_max
+    return state_area.state_mask, state_area.border_mask, x_min, y_min, x_max, y_max
 
 ### Script Formatting Methods ###
+# These take and return script text, parsing it each time. When reading or editing a script more than once, use a ScriptDocument instead, which is parsed only once.
 # Get the string content following a field of the argued name in this script.
 def get_field_content(script, field_name, is_table = False):
-    field_ind, opening_ind, closing_ind, field_closing_ind, tabs = get_field_indices(script, field_name, is_table)
-    if opening_ind == -1:
-        return None
-
-    content = script[opening_ind:closing_ind]
-
-    # Convert any tabs and newlines in the content to spaces, then remove the ones at the start and end.
-    content = content.replace("\t", "")
-    content = content.replace("\n", " ")
-
-    start_trim = 0
-    for c in range(len(content)):
-        if content[c] == " ":
-            start_trim = c + 1
-        else:
-            break
-    content = content[start_trim:len(content)]
-
-    end_trim = len(content)
-    for c in range(len(content) - 1, -1, -1):
-        if content[c] == " ":
-            end_trim = c
-        else:
-            break
-    content = content[0:end_trim]
-    
-    return content
+    return ScriptDocument(script).get_field_content(field_name, is_table)
 
 # Set the string content following a field of the argued name in this script.
 def set_field_content(script, field_name, new_content, is_table = False):
-    field_int, opening_ind, closing_ind, field_closing_ind, tab_count = get_field_indices(script, field_name, is_table)
-    if opening_ind == -1:
-        raise Exception("Cannot set the field of name '{}' because such a field with the appropriate opening format was not found in ths script.".format(field_name))
-
-    formatted_content = ""
-    if is_table:
-        formatted_content = "\n"
-        tab_string = ""
-        for t in range(tab_count):
-            tab_string += "\t"
-        formatted_content += tab_string + "\t" + new_content + "\n" + tab_string
-    else:
-        formatted_content = new_content
-
-    script = script[0:opening_ind] + formatted_content + script[closing_ind:len(script)]
-    return script
+    document = ScriptDocument(script)
+    document.set_field_content(field_name, new_content, is_table)
+    return document.get_text()
 
 # Delete a field and its content of the argued name in this script.
 def delete_field(script, field_name, is_table = False):
-    field_ind, opening_ind, closing_ind, field_closing_ind, tab_count = get_field_indices(script, field_name, is_table)
-    
-    if opening_ind == -1:
-        return script
-    else:
-        prev_nl = script.rfind("\n", 0, field_ind)
-        next_nl = field_closing_ind
-        if prev_nl == -1:
-            prev_nl = 0
-
-             # If there was no previous newline found, we're at the start of the file. See if there's a following newline.
-            next_nl = script.find("\n", closing_ind)
-            if next_nl == -1:
-                next_nl = len(script)
-        
-        return script[0:prev_nl] + script[next_nl:len(script)]
-
-# Gets the index of the start of this field in the script, the start of its content, the end of its content, and the tabs that the field sits on.
-def get_field_indices(script, field_name, is_table = False):
-    opening_format = []
-    closing_format = ""
-
-    closing_offset = 0
-    if is_table:
-        opening_format = ["={", " = {", "= {", " ={"]
-        closing_format = "}"
-        closing_offset = 1
-    else:
-        opening_format = ["=", " ="]
-        closing_format = "\n"
-
-    format_offset = 0
-    for o in opening_format:
-        field_ind = script.find(field_name + o)
-        if field_ind != -1:
-            format_offset = len(o)
-            break
-
-    if field_ind == -1:
-        return -1, -1, -1, -1, 0
-
-    content_ind = field_ind + len(field_name) + format_offset
-    closing_ind = script.find(closing_format, content_ind)
-    # If there's no closing format after the field, then it must be at the end of the file.
-    if closing_ind == -1:
-        closing_ind = len(script)
-    field_closing_ind = closing_ind + closing_offset
-
-    tab_count = 0
-    prev_nl = script.rfind("\n", 0, content_ind)
-    if prev_nl != -1:
-        tab_count = script.count("\t", prev_nl, content_ind)
-
-    return field_ind, content_ind, closing_ind, field_closing_ind, tab_count
-
-# Find the ID associated with the province color in the definitions text.
-def get_province_id(province_col, definitions_text):
-    province_col_string = ";" + str(province_col[0]) + ";" + str(province_col[1]) + ";" + str(province_col[2]) + ";"
-    province_index = definitions_text.find(province_col_string)
-    if province_index == -1:
-        raise Exception("The province color '{}' was not present in the argued definitions text. Did you run Hearts of Iron after adding these provinces? This is required for the game to assign an ID to the new province colors.".format(province_col_string))
-        return
-    previous_new_line = definitions_text.rfind("\n", 0, province_index)
-    id_index = 0
-    # If there's no new line, this is just the first province in the file.
-    if previous_new_line != -1:
-        id_index = previous_new_line + 1
-
-    return int(definitions_text[id_index:province_index])
-
-# Get the indices encapsulating a province's definition line. Returns two -1s if the color code was not found.
-def get_province_line(province_col, definitions_text):
-    province_col_string = ";" + str(province_col[0]) + ";" + str(province_col[1]) + ";" + str(province_col[2]) + ";"
-    color_index = definitions_text.find(province_col_string)
-    if color_index == -1:
-        return -1, -1
-    
-    start_index = definitions_text.rfind("\n", 0, color_index)
-    start_index_offset = 1
-    if start_index == -1:
-        start_index = 0
-        start_index_offset = 0
-    end_index = definitions_text.find("\n", color_index, len(definitions_text))
-    if end_index == -1:
-        end_index = len(definitions_text)
-
-    return start_index + start_index_offset, end_index
-
-# Gets the id number on the last line of the definitions text.
-def get_highest_province_id(definitions_text):
-    if definitions_text == "":
+    document = ScriptDocument(script)
+    document.delete_field(field_name, is_table)
+    return document.get_text()
+
+### Province Definition Methods ###
+# The contents of a definition.csv file, parsed once. Each line of the file is a row, and rows that define a province have their ID and packed color stored in arrays,
+# along with a hash index from packed color to row. This makes looking up or rewriting a province's definition O(1), rather than a search through the whole text.
+# A province definition uses the format "ID;R;G;B;Type;Is_Coastal?;Terrain;Continent".
+class DefinitionsTable:
+    def __init__(self, definitions_text = ""):
+        self.lines = definitions_text.split("\n") if definitions_text != "" else []
+        self.ends_with_new_line = definitions_text.endswith("\n")
+        if self.ends_with_new_line:
+            self.lines.pop()
+
+        self.row_count = len(self.lines)
+        self.ids = numpy.full(self.row_count, -1, dtype = numpy.int64)   # The province ID of each row, or -1 if the row isn't a province definition.
+        self.keys = numpy.zeros(self.row_count, dtype = numpy.uint32)    # The packed color of each row.
+        self.index = {} # The row of each packed color. If a color is defined more than once, the first row is used.
+
+        for r in range(self.row_count):
+            fields = self.lines[r].split(";", 4)
+            if len(fields) < 4:
+                continue
+            try:
+                province_id = int(fields[0])
+                key = pack_color((int(fields[1]), int(fields[2]), int(fields[3])))
+            except ValueError:
+                continue
+
+            self.ids[r] = province_id
+            self.keys[r] = key
+            if key not in self.index:
+                self.index[key] = r
+
+    def __len__(self):
+        return self.row_count
+
+    # Get the row defining the argued province color, or -1 if the color has no definition.
+    def get_row(self, province_col):
+        return self.index.get(pack_color(province_col), -1)
+
+    # Find the ID associated with the province color.
+    def get_id(self, province_col):
+        row = self.get_row(province_col)
+        if row == -1:
+            raise Exception("The province color '{}' was not present in the definitions. Did you run Hearts of Iron after adding these provinces? This is required for the game to assign an ID to the new province colors.".format(tuple(int(c) for c in province_col)))
+        return int(self.ids[row])
+
+    # Find the IDs associated with an array of packed province colors. Colors with no definition are given an ID of -1.
+    def get_ids(self, keys):
+        rows = numpy.array([self.index.get(int(k), -1) for k in numpy.ravel(keys)], dtype = numpy.int64)
+        return numpy.where(rows == -1, -1, self.ids[rows]).reshape(numpy.shape(keys))
+
+    # Get the definition line of the argued province color, or None if the color has no definition.
+    def get_line(self, province_col):
+        row = self.get_row(province_col)
+        return None if row == -1 else self.lines[row]
+
+    # Gets the ID number on the last populated line of the definitions, or 0 if there are none.
+    def get_highest_id(self):
+        for r in range(self.row_count - 1, -1, -1):
+            if self.lines[r] == "":
+                continue
+            if self.ids[r] == -1:
+                raise Exception("Error: The last populated line of the definitions is not a valid province definition, and therefore must be wrongly formatted.")
+            return int(self.ids[r])
         return 0
-    
-    last_new_line = -1
-    search_start = len(definitions_text)
-    while last_new_line == -1:
-        discovered_new_line = definitions_text.rfind("\n", 0, search_start)
-        new_line_offset = 1
-        
-        # If there are no new lines in this text, there must only be one province definition.
-        if discovered_new_line == -1:
-            discovered_new_line = 0
-            new_line_offset = 0
-            
-        # If this line isn't empty, we've found the appropriate last line.
-        if definitions_text[discovered_new_line + new_line_offset:len(definitions_text)] != "":
-            last_new_line = discovered_new_line + new_line_offset
-
-        search_start = discovered_new_line
-
-    next_semicolon = definitions_text.find(";", last_new_line, len(definitions_text))
-    if next_semicolon == -1:
-        raise Exception("Error: The last populated line of the argued definition text does not have a semicolon in it, and therefore must be wrongly formatted.")
-
-    return int(definitions_text[last_new_line:next_semicolon])
+
+    # Define the province of the argued color with the argued fields (every field after the color, as strings).
+    # An existing definition keeps its ID and is rewritten in place. Otherwise the province is added to the end with the ID after the highest one. Returns the province's ID.
+    def set_definition(self, province_col, fields):
+        row = self.get_row(province_col)
+        if row == -1:
+            province_id = self.get_highest_id() + 1
+            row = self.append_row(province_id, pack_color(province_col))
+        else:
+            province_id = int(self.ids[row])
+
+        self.lines[row] = ";".join([str(province_id), str(int(province_col[0])), str(int(province_col[1])), str(int(province_col[2]))] + list(fields))
+        return province_id
+
+    # Add a new row for the argued ID and packed color to the end of the table. Returns the index of the new row.
+    def append_row(self, province_id, key):
+        # Grow the arrays by doubling, so that appending many rows stays cheap.
+        if self.row_count == len(self.ids):
+            capacity = max(16, len(self.ids) * 2)
+            self.ids = numpy.concatenate((self.ids, numpy.full(capacity - len(self.ids), -1, dtype = numpy.int64)))
+            self.keys = numpy.concatenate((self.keys, numpy.zeros(capacity - len(self.keys), dtype = numpy.uint32)))
+
+        row = self.row_count
+        self.lines.append("")
+        self.ids[row] = province_id
+        self.keys[row] = key
+        self.index[key] = row
+        self.row_count += 1
+        return row
+
+    # Get the definitions as one string.
+    def get_text(self):
+        return "\n".join(self.lines) + ("\n" if self.ends_with_new_line else "")
+
+    # Write the definitions to the argued file in a single pass.
+    @timed("write definitions")
+    def write(self, file_dir):
+        with open(file_dir, "w+") as definitions_file:
+            for r in range(self.row_count):
+                definitions_file.write(self.lines[r])
+                if r < self.row_count - 1 or self.ends_with_new_line:
+                    definitions_file.write("\n")
+
+# Read the definitions file at the argued directory into a DefinitionsTable.
+@timed()
+def read_definitions(file_dir):
+    with open(file_dir, "r") as definitions_file:
+        return DefinitionsTable(definitions_file.read())